@@ -0,0 +1,75 @@
+import hashlib
+import os
+import pickle
+import re
+import tempfile
+
+def file_digest(fname):
+    """sha256 hex digest of a file's contents"""
+    digest = hashlib.sha256()
+    with open(fname, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def remove(path):
+    """Remove path unless another process already has"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+class ParseCache:
+    """On-disk cache of parsed input files.
+
+Entries are keyed by the file's content hash, the parse options and the
+source of the modules that did the parsing, so editing the input or the
+parser invalidates them. Only the newest entry for each kind and file
+path is kept."""
+    def __init__(self, directory, parsers=()):
+        self.directory = directory
+        self.parser_digest = hashlib.sha256(''.join(file_digest(parser.__file__) for parser in parsers).encode()).hexdigest()
+
+    def key(self, fname, **options):
+        digest = hashlib.sha256()
+        for part in (file_digest(fname), self.parser_digest, repr(sorted(options.items()))):
+            digest.update(part.encode())
+        return digest.hexdigest()
+
+    def prefix(self, fname, kind):
+        # the path hash keeps same named files in different directories apart
+        path_digest = hashlib.sha256(os.path.abspath(fname).encode()).hexdigest()[:12]
+        return '{}-{}-{}-'.format(kind, re.sub(r'[^A-Za-z0-9_.]', '_', os.path.basename(fname)), path_digest)
+
+    def load(self, fname, kind, parse, **options):
+        """Return the cached result of parse() for fname, calling it and
+storing the result on a miss"""
+        prefix = self.prefix(fname, kind)
+        path = os.path.join(self.directory, prefix + self.key(fname, **options) + '.pickle')
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception:
+            # a truncated or stale pickle can fail in many ways; rebuild it
+            remove(path)
+
+        value = parse()
+        self.store(path, prefix, value)
+        return value
+
+    def store(self, path, prefix, value):
+        os.makedirs(self.directory, exist_ok=True)
+        for entry in os.listdir(self.directory):
+            if entry.startswith(prefix) and entry.endswith('.pickle'):
+                remove(os.path.join(self.directory, entry))
+        # a temporary file of its own, other processes may store the same entry
+        fd, tmp_name = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with open(fd, 'wb') as f:
+                pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            os.remove(tmp_name)
+            return
+        os.replace(tmp_name, path)
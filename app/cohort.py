@@ -0,0 +1,90 @@
+import numpy as np
+
+class CohortScores:
+    """Peer scores for a whole cohort, stored as a students x qualities x
+raters array with a mask marking which entries hold a score"""
+
+    def __init__(self, qualities, students=16, raters=8):
+        self.qualities = list(qualities)
+        self._quality_index = { quality: i for i, quality in enumerate(self.qualities) }
+        shape = (students, len(self.qualities), raters)
+        self.scores = np.zeros(shape)
+        self.mask = np.zeros(shape, dtype=bool)
+        self.raters = np.zeros(students, dtype=int)
+        self.size = 0
+        self._means = None
+        self._subtotals = None
+
+    def _grow(self, students, raters):
+        shape = (students, len(self.qualities), raters)
+        scores = np.zeros(shape)
+        mask = np.zeros(shape, dtype=bool)
+        old_students, _, old_raters = self.scores.shape
+        scores[:old_students, :, :old_raters] = self.scores
+        mask[:old_students, :, :old_raters] = self.mask
+        self.scores = scores
+        self.mask = mask
+        raters = np.zeros(students, dtype=int)
+        raters[:old_students] = self.raters
+        self.raters = raters
+
+    def add_student(self):
+        """Reserve a row for a new student and return its index"""
+        students, _, raters = self.scores.shape
+        if self.size == students:
+            self._grow(max(1, 2 * students), raters)
+        self.size += 1
+        self._invalidate()
+        return self.size - 1
+
+    def add_rater(self, student):
+        """Reserve the next rater slot for student and return its index"""
+        students, _, raters = self.scores.shape
+        slot = self.raters[student]
+        if slot == raters:
+            self._grow(students, max(1, 2 * raters))
+        self.raters[student] += 1
+        return slot
+
+    def set_score(self, student, quality, rater, value):
+        if value is None:
+            return
+        q = self._quality_index[quality]
+        self.scores[student, q, rater] = value
+        self.mask[student, q, rater] = True
+        self._invalidate()
+
+    def scores_for(self, student, quality):
+        """Raw scores given to student for quality, None where a rater left
+it blank"""
+        q = self._quality_index[quality]
+        n = self.raters[student]
+        return [ float(score) if present else None
+                 for score, present in zip(self.scores[student, q, :n], self.mask[student, q, :n]) ]
+
+    def _invalidate(self):
+        self._means = None
+        self._subtotals = None
+
+    def _reduce(self):
+        scores = self.scores[:self.size]
+        mask = self.mask[:self.size]
+        counts = mask.sum(axis=2)
+        sums = np.where(mask, scores, 0.0).sum(axis=2)
+        means = np.divide(sums, counts, out=np.zeros_like(sums), where=counts > 0)
+        self._means = means.tolist()
+        self._subtotals = means.sum(axis=1).tolist()
+
+    @property
+    def means(self):
+        """Per student, per quality mean of the scores present (0 if none)"""
+        if self._means is None:
+            self._reduce()
+        return self._means
+
+    @property
+    def subtotals(self):
+        """Per student sum of the quality means"""
+        if self._subtotals is None:
+            self._reduce()
+        return self._subtotals
@@ -1,8 +1,15 @@
 # see http://norvig.com/spell-correct.html
 import re
+import os
+import json
+import shutil
+import tempfile
 import collections
 
+from util import damerau_levenshtein, count, replay_journal
+
 alphabet = 'abcdefghijklmnopqrstuvwxyz'
+compact_threshold = 64 # minimum journal length before it is compacted
     
 def edits1(word):
     splits     = [(word[:i], word[i:]) for i in range(len(word) + 1)]
@@ -10,19 +17,58 @@ def edits1(word):
     transposes = [a + b[1] + b[0] + b[2:] for a, b in splits if len(b)>1]
     replaces   = [a + c + b[1:] for a, b in splits for c in alphabet if b]
     inserts    = [a + c + b     for a, b in splits for c in alphabet]
+    count('edit_candidates', len(deletes) + len(transposes) + len(replaces) + len(inserts))
     return set(deletes + transposes + replaces + inserts)
 
+def format_alias(alias, real):
+    return json.dumps([alias, real], ensure_ascii=False) + '\n'
+
+def parse_alias(line):
+    """Parse one alias journal record, also accepting the old 'alias: real'
+format"""
+    if line.startswith('['):
+        alias, real = json.loads(line)
+    else:
+        alias, _, real = line.partition(':')
+    return alias.lower().strip(), real.strip()
+
+def deletes(word, max_distance):
+    """All strings reachable from word by deleting up to max_distance
+characters, including word itself"""
+    results = { word }
+    frontier = { word }
+    for _ in range(max_distance):
+        frontier = { w[:i] + w[i+1:] for w in frontier for i in range(len(w)) }
+        results |= frontier
+    count('edit_candidates', len(results))
+    return results
+
 class Corrector:
     def __init__(self, training_words, **kwargs):
         self.model = collections.defaultdict(lambda: 1)
         self.aliases = {}
         for f in training_words:
             self.model[f] += 1
+        # symmetric delete index: every known word is reachable from each
+        # of its deletes, so a lookup only has to generate deletes of the query
+        self.max_distance = kwargs.pop('max_distance', 2)
+        self.index = collections.defaultdict(set)
+        for word in self.model:
+            for d in deletes(word, self.max_distance):
+                self.index[d].add(word)
         self.alias_file = kwargs.pop('alias', None)
-        try:
-            self.load_aliases(self.alias_file)
-        except FileNotFoundError:
-            pass
+        # read only correctors never write the journal, for worker processes
+        # sharing it with the parent
+        self.read_only = kwargs.pop('read_only', False)
+        self.journal_records = 0
+        if self.alias_file is not None:
+            try:
+                self.load_aliases(self.alias_file)
+            except FileNotFoundError:
+                pass
+            else:
+                if not self.read_only and self.journal_records > max(compact_threshold, 2 * len(self.aliases)):
+                    self.save_aliases(self.alias_file)
             
     def known_edits2(self, word):
         return set(e2 for e1 in edits1(word) for e2 in edits1(e1) if e2 in self.model)
@@ -30,23 +76,66 @@ class Corrector:
     def known(self, words):
        return set(w for w in words if w in self.model)
 
+    def candidates(self, word):
+        """Known words closest to word, within max_distance edits as
+measured by damerau_levenshtein"""
+        if word in self.model:
+            return { word }
+        best = self.max_distance + 1
+        found = set()
+        seen = set()
+        for d in deletes(word, self.max_distance):
+            for candidate in self.index.get(d, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                distance = damerau_levenshtein(word, candidate)
+                if distance > self.max_distance:
+                    continue
+                if distance < best:
+                    best = distance
+                    found = { candidate }
+                elif distance == best:
+                    found.add(candidate)
+        return found
+
     def add_alias(self, alias, real):
+        if self.aliases.get(alias) == real:
+            return
         self.aliases[alias] = real
-        if self.alias_file is not None:
-            self.save_aliases(self.alias_file)
+        if self.alias_file is not None and not self.read_only:
+            self.append_alias(self.alias_file, alias, real)
        
     def correct(self, word, aliases=None):
         if word in self.aliases:
             return self.aliases[word]
-        candidates = self.known([word]) or self.known(edits1(word)) or self.known_edits2(word) or [word]
-        return max(candidates, key=self.model.get)
+        candidates = self.candidates(word) or [word]
+        return max(sorted(candidates), key=self.model.get) # sorted so ties don't depend on set order
 
     def load_aliases(self, file_name):
-        with open(file_name, 'r') as f:
-            for line in f:
-                alias, real = line.split(':')
-                self.aliases[alias.lower().strip()] = real.strip()
+        """Replay the alias journal, later records win"""
+        replay_journal(file_name, self.replay_alias, repair=not self.read_only)
+
+    def replay_alias(self, line):
+        alias, real = parse_alias(line.strip())
+        self.aliases[alias] = real
+        self.journal_records += 1
+
+    def append_alias(self, file_name, alias, real):
+        """Durably append a single record to the alias journal"""
+        with open(file_name, 'a', encoding='utf-8') as f:
+            f.write(format_alias(alias, real))
+            f.flush()
+            os.fsync(f.fileno())
+        self.journal_records += 1
     
     def save_aliases(self, file_name):
-        with open(file_name, 'w') as f:
-            f.writelines([ '{}: {}\n'.format(k,v) for k,v in self.aliases.items() ])
+        """Compact the journal into a snapshot with one record per alias"""
+        fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(file_name)), suffix='.tmp')
+        with open(fd, 'w', encoding='utf-8') as f:
+            f.writelines([ format_alias(k, v) for k,v in self.aliases.items() ])
+            f.flush()
+            os.fsync(f.fileno())
+        shutil.copymode(file_name, tmp_name)
+        os.replace(tmp_name, file_name)
+        self.journal_records = len(self.aliases)
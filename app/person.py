@@ -1,49 +1,123 @@
-from util import num_or_string, issumable, levenshtein
+from util import num_or_string, issumable, nearest, bitparallel_masks, levenshtein_bitparallel
 from scholar.gradebook import GradebookItem
-from .exceptions import UniquePersonError
+from .exceptions import UniquePersonError, UnknownPersonError
 from sys import stdout
 
-def name_prompt(prompt, people, name):
+def name_prompt(prompt, people, name, ask=input, show=print, names=None):
+    """Ask who name refers to, offering the five closest names in people.
+ask and show default to the console. names, the (lowercased full name,
+person) pairs of people, may be passed in when prompting repeatedly."""
     person = None
+    if names is None:
+        names = lowered_names(people)
+    choices = [ person for _, person in nearest(name.lower(), names, 5, key=lambda n: n[0]) ]
 
     while (person is None):
-        print(prompt)
-        choices = [ person for person in sorted(people, key=lambda s: levenshtein(s.full_name.lower(), name)) ][:5]
+        show(prompt)
         for number,choice in enumerate(choices):
-            print("{}) {}".format(number+1, choice.full_name))
-        user_choice = input('Choose one or write in: ')
+            show("{}) {}".format(number+1, choice.full_name))
+        user_choice = ask('Choose one or write in: ')
         try:
             person =  choices[int(user_choice)-1]
         except ValueError as e:
             return user_choice #TODO: move looping until valid name into here?
         except IndexError as e:
-            print("Invalid selection")
+            show("Invalid selection")
 
     return person.full_name
 
+def lowered_names(people):
+    return [ (person.full_name.lower(), person) for person in people ]
+
+def normalize(name):
+    return name.lower().strip()
+
 class people_finder:
-    """Find people by fuzzy matching names"""
+    """Find people by fuzzy matching names.
+
+When the review being resolved carries a section and group, candidates
+are blocked by team first, then widened to the section and finally the
+whole course."""
               
-    def __init__(self,name_corrector=None):
+    def __init__(self, name_corrector=None, **kwargs):
         self.name_corrector = name_corrector
-              
+        self.max_distance = kwargs.pop('max_distance', 2)
+        self.prompt = kwargs.pop('prompt', name_prompt)
+        self._people = None
+
+    def index(self, people):
+        """Build name, team and section indexes for people, reused for as
+long as the same list is passed in"""
+        if people is self._people:
+            return
+        self._people = people
+        self._names = {}
+        self._teams = {}
+        self._sections = {}
+        for person in people:
+            section = getattr(person, 'section', None)
+            group = getattr(person, 'group', None)
+            self._names.setdefault(normalize(person.full_name), []).append(person)
+            self._teams.setdefault((section, group), []).append(person)
+            self._sections.setdefault(section, []).append(person)
+        self._lowered = lowered_names(people)
+
+    def exact(self, people, normalized_name):
+        return [ person for person in people if normalize(person.full_name) == normalized_name ]
+
+    def fuzzy(self, people, normalized_name):
+        """The unique person in people whose name is within max_distance
+edits of normalized_name, or a unique first or last name match"""
+        masks = bitparallel_masks(normalized_name)
+        best = self.max_distance + 1
+        found = []
+        for person in people:
+            distance = levenshtein_bitparallel(normalized_name, normalize(person.full_name), masks, self.max_distance)
+            if distance < best:
+                best = distance
+                found = [ person ]
+            elif distance == best and distance <= self.max_distance:
+                found.append(person)
+        if len(found) == 1:
+            return found
+        found = [ person for person in people
+                  if normalized_name in (normalize(person.first_name), normalize(person.last_name)) ]
+        if len(found) == 1:
+            return found
+        return []
+
+    def match(self, people, normalized_name, review=None):
+        """Resolve a name without prompting, returning a (possibly empty)
+list of matching people"""
+        self.index(people)
+        if review is not None:
+            team = self._teams.get((review.section, review.group), [])
+            section = self._sections.get(review.section, [])
+            found = self.exact(team, normalized_name)
+            if found:
+                return found
+            if self.name_corrector and normalized_name in self.name_corrector.aliases:
+                return self._names.get(normalize(self.name_corrector.aliases[normalized_name]), [])
+            found = self.fuzzy(team, normalized_name) or self.exact(section, normalized_name) or self.fuzzy(section, normalized_name)
+            if found:
+                return found
+        found = self._names.get(normalized_name, [])
+        if len(found) == 0 and self.name_corrector:
+            found = self._names.get(self.name_corrector.correct(normalized_name), [])
+        return found
+
     def find_person(self, people, name, **kwargs):
-        normalized_name = name.lower().strip()
-        found = [ person for person in people if person.full_name.lower().strip() == normalized_name ]
         review = kwargs.pop('review', None)
-        if len(found) == 0:
-            if self.name_corrector:
-              normalized_name = self.name_corrector.correct(normalized_name)
-              found = [ person for person in people if person.full_name.lower().strip() == normalized_name ]
-            while (len(found) < 1):
-              prompt = ""
-              if review is not None:
-                  prompt += "in section {}, Team {} ".format(review.section, review.group)
-              prompt += 'who is "{}"? '.format(name)    
-              #real_name = input(prompt[:1].upper() + prompt[1:]).lower().strip()
-              real_name = name_prompt(prompt[:1].upper() + prompt[1:], people, name).lower().strip()
-              found = [ person for person in people if person.full_name.lower().strip() == real_name ]
-              self.name_corrector.add_alias(name.lower().strip(), real_name)
+        found = self.match(people, normalize(name), review)
+        while (len(found) < 1):
+            prompt = ""
+            if review is not None:
+                prompt += "in section {}, Team {} ".format(review.section, review.group)
+            prompt += 'who is "{}"? '.format(name)    
+            real_name = normalize(self.prompt(prompt[:1].upper() + prompt[1:], people, name, names=self._lowered))
+            found = self._names.get(real_name, [])
+            if found and self.name_corrector:
+                self.name_corrector.add_alias(normalize(name), real_name)
               
         if len(found) == 0:
             raise UnknownPersonError(name)
@@ -0,0 +1,111 @@
+import json
+import string
+from statistics import median
+
+class PolicyError(Exception):
+    pass
+
+# values a rule can test, computed for each review by review_context
+context_keys = ('peer_subtotal', 'submitted', 'reviews', 'team_median', 'team_deviation', 'instructor_points')
+
+def matches(condition, value):
+    """A condition is either [low, high], inclusive and with null for an
+open end, or a value that must be equal"""
+    if isinstance(condition, list):
+        low, high = condition
+        return (low is None or value >= low) and (high is None or value <= high)
+    return value == condition
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def check_template(comments):
+    """Check the {placeholders} of a comments template name context
+values, so a bad one fails when the policy is loaded"""
+    if not isinstance(comments, str):
+        raise PolicyError('comments must be a string, not {}'.format(json.dumps(comments)))
+    try:
+        fields = [ field for _, field, _, _ in string.Formatter().parse(comments) if field is not None ]
+    except ValueError as e:
+        raise PolicyError("comments '{}': {}".format(comments, e))
+    for field in fields:
+        if field.split('.')[0].split('[')[0] not in context_keys:
+            raise PolicyError("unknown value '{{{}}}' in comments, expected one of {}".format(
+                field, ', '.join(context_keys)))
+
+class Rule:
+    def __init__(self, when=None, points=None, comments=None, escalate=False):
+        self.when = when or {}
+        if not isinstance(self.when, dict):
+            raise PolicyError('when must map value names to conditions, not {}'.format(json.dumps(self.when)))
+        for key, condition in self.when.items():
+            if key not in context_keys:
+                raise PolicyError("unknown value '{}' in rule, expected one of {}".format(key, ', '.join(context_keys)))
+            if isinstance(condition, list):
+                if len(condition) != 2 or not all(bound is None or is_number(bound) for bound in condition):
+                    raise PolicyError("range for '{}' must be [low, high] numbers or null, not {}".format(
+                        key, json.dumps(condition)))
+        if isinstance(points, str):
+            if points not in context_keys:
+                raise PolicyError("unknown value '{}' for points".format(points))
+        elif points is not None and not is_number(points):
+            raise PolicyError('points must be a number or a value name, not {}'.format(json.dumps(points)))
+        if comments is not None:
+            check_template(comments)
+        self.points = points
+        self.comments = comments
+        self.escalate = escalate
+
+    def applies(self, context):
+        return all(matches(condition, context[key]) for key, condition in self.when.items())
+
+    def apply(self, review, context):
+        if self.points is not None:
+            review.instructor_points = context[self.points] if isinstance(self.points, str) else self.points
+        if self.comments is not None:
+            review.comments = self.comments.format(**context)
+
+class Policy:
+    """Scoring rules read from a JSON file holding a list of rules such as
+
+    {"when": {"peer_subtotal": [null, 6]}, "escalate": true}
+    {"when": {"submitted": false}, "points": 0, "comments": "No review submitted"}
+
+The first rule whose conditions all hold decides a student's instructor
+points and comments, and whether they are graded interactively."""
+    def __init__(self, rules):
+        self.rules = [ Rule(**rule) for rule in rules ]
+
+    @classmethod
+    def from_file(cls, fname):
+        with open(fname, 'r', encoding='utf-8') as f:
+            try:
+                return cls(json.load(f))
+            except (ValueError, TypeError) as e:
+                raise PolicyError('{}: {}'.format(fname, e))
+
+    def team_medians(self, reviews):
+        """Median peer subtotal of every (section, group)"""
+        teams = {}
+        for review in reviews:
+            teams.setdefault((review.section, review.group), []).append(review.peer_score)
+        return { team: median(scores) for team, scores in teams.items() }
+
+    def review_context(self, review, team_medians):
+        team_median = team_medians.get((review.section, review.group), review.peer_score)
+        return { 'peer_subtotal': review.peer_score,
+                 'submitted': review.submitted,
+                 'reviews': review.reviews_received,
+                 'team_median': team_median,
+                 'team_deviation': review.peer_score - team_median,
+                 'instructor_points': review.instructor_points }
+
+    def apply(self, review, team_medians):
+        """Apply the first matching rule to review and return it, or None
+if no rule matches"""
+        context = self.review_context(review, team_medians)
+        for rule in self.rules:
+            if rule.applies(context):
+                rule.apply(review, context)
+                return rule
+        return None
@@ -0,0 +1,57 @@
+import cProfile
+import time
+from contextlib import contextmanager
+
+import util
+
+class Profiler:
+    """Wall clock and CPU time spent in each phase of a run. When stats_file
+is given the run is also profiled with cProfile and the stats written
+there by finish(). A disabled Profiler times nothing."""
+    def __init__(self, enabled=True, stats_file=None):
+        self.enabled = enabled
+        self.phases = {} # name: [wall, cpu, calls]
+        self.stats_file = stats_file
+        self.profile = None
+        if enabled:
+            util.counters.clear()
+            util.counting = True
+            if stats_file:
+                self.profile = cProfile.Profile()
+                self.profile.enable()
+
+    @contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            totals = self.phases.setdefault(name, [0.0, 0.0, 0])
+            totals[0] += time.perf_counter() - wall
+            totals[1] += time.process_time() - cpu
+            totals[2] += 1
+
+    def finish(self):
+        util.counting = False
+        if self.profile is not None:
+            self.profile.disable()
+            self.profile.dump_stats(self.stats_file)
+            self.profile = None
+
+    def report(self):
+        """Summary table of the phase times and hot path counters"""
+        lines = [ '{:<12} {:>10} {:>10} {:>6}'.format('phase', 'wall (s)', 'cpu (s)', 'calls') ]
+        for name, (wall, cpu, calls) in self.phases.items():
+            lines.append('{:<12} {:>10.4f} {:>10.4f} {:>6}'.format(name, wall, cpu, calls))
+        if util.counters:
+            lines.append('')
+            lines.append('{:<24} {:>10}'.format('counter', 'count'))
+            for name, n in sorted(util.counters.items()):
+                lines.append('{:<24} {:>10}'.format(name, n))
+        if self.stats_file:
+            lines.append('')
+            lines.append('cProfile stats written to {}'.format(self.stats_file))
+        return '\n'.join(lines)
@@ -0,0 +1,54 @@
+import hashlib
+import json
+import os
+
+from util import replay_journal
+from .cache import file_digest
+
+def session_name(input_files, item_name):
+    """Session log file name for grading item_name from input_files"""
+    digest = hashlib.sha256()
+    for digest_part in sorted(file_digest(fname) for fname in input_files):
+        digest.update(digest_part.encode())
+    digest.update(item_name.encode())
+    return 'session_{}.log'.format(digest.hexdigest()[:16])
+
+class SessionLog:
+    """Append-only log of the instructor scores and comments entered in an
+interactive session, replayed to resume an interrupted session"""
+    def __init__(self, fname):
+        self.fname = fname
+        self.entries = {}
+        try:
+            self.replay()
+        except FileNotFoundError:
+            pass
+
+    def replay(self):
+        # logs written before torn records were cut may hold one mid-file
+        replay_journal(self.fname, self.replay_entry, strict=False)
+
+    def replay_entry(self, line):
+        entry = json.loads(line)
+        self.entries[entry['pid']] = (entry['points'], entry['comments'])
+
+    def __contains__(self, pid):
+        return pid in self.entries
+
+    def __getitem__(self, pid):
+        return self.entries[pid]
+
+    def record(self, pid, points, comments):
+        with open(self.fname, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({ 'pid': pid, 'points': points, 'comments': comments }, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.entries[pid] = (points, comments)
+
+    def remove(self):
+        """Discard the log once its scores have been written"""
+        try:
+            os.remove(self.fname)
+        except FileNotFoundError:
+            pass
+        self.entries = {}
@@ -0,0 +1,380 @@
+import csv
+import json
+import os
+import sqlite3
+import threading
+
+from scholar.csvinput import CSVInput
+from scholar.gradebook import (RowLayout, GradebookRow, GradebookScore, NoSuchItem, NoSuchRecord,
+                               gradebook_items_from_fieldnames, indexed_attrs, normalize_name)
+from scholar.tests_quizzes import fields, question_id
+from util import num_or_none, count
+from .cache import file_digest
+from .corrector import format_alias, parse_alias
+
+schema = '''
+CREATE TABLE IF NOT EXISTS exports (
+    item TEXT NOT NULL, source TEXT NOT NULL, fieldnames TEXT NOT NULL, encoding TEXT, delimiter TEXT,
+    digest TEXT, PRIMARY KEY (item, source));
+CREATE TABLE IF NOT EXISTS submissions (
+    id INTEGER PRIMARY KEY, item TEXT NOT NULL, source TEXT NOT NULL, row INTEGER NOT NULL, width INTEGER NOT NULL,
+    pid TEXT NOT NULL, first_name TEXT, last_name TEXT, submission_order TEXT, attempt INTEGER,
+    section TEXT, grp TEXT);
+CREATE INDEX IF NOT EXISTS submissions_pid ON submissions (pid, item);
+CREATE INDEX IF NOT EXISTS submissions_team ON submissions (item, section, grp);
+CREATE INDEX IF NOT EXISTS submissions_source ON submissions (item, source, row);
+CREATE TABLE IF NOT EXISTS responses (
+    submission INTEGER NOT NULL REFERENCES submissions (id) ON DELETE CASCADE, col INTEGER NOT NULL,
+    part INTEGER, question INTEGER, value TEXT,
+    PRIMARY KEY (submission, col)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS reviews (
+    id INTEGER PRIMARY KEY, item TEXT NOT NULL, reviewer TEXT NOT NULL, reviewee TEXT NOT NULL,
+    name TEXT, section TEXT, grp TEXT);
+CREATE INDEX IF NOT EXISTS reviews_reviewee ON reviews (reviewee, item);
+CREATE INDEX IF NOT EXISTS reviews_item ON reviews (item, section, grp);
+CREATE TABLE IF NOT EXISTS review_answers (
+    review INTEGER NOT NULL REFERENCES reviews (id) ON DELETE CASCADE, question INTEGER NOT NULL, result TEXT,
+    PRIMARY KEY (review, question)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS aliases (alias TEXT PRIMARY KEY, real TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS gradebook (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS students (
+    pid TEXT PRIMARY KEY, position INTEGER NOT NULL, name TEXT, normalized_name TEXT, section TEXT,
+    cells TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS students_name ON students (normalized_name);
+CREATE INDEX IF NOT EXISTS students_section ON students (section);
+CREATE TABLE IF NOT EXISTS scores (
+    pid TEXT NOT NULL, item TEXT NOT NULL, points TEXT, comments TEXT,
+    PRIMARY KEY (pid, item)) WITHOUT ROWID;
+'''
+
+def points_text(points):
+    """Points as patch_gradebook_items writes them"""
+    if points is None:
+        return ''
+    value = num_or_none(float, points)
+    return '' if value is None else str(value)
+
+class Store:
+    """SQLite database of Tests & Quizzes submissions, resolved reviews,
+aliases and gradebook scores, kept between runs so they can be queried
+across items and terms. Every table is loaded from and written back to
+the usual CSV formats."""
+    def __init__(self, fname):
+        self.fname = fname
+        # the review phase looks up scores from its prefetch threads
+        self.db = sqlite3.connect(fname, check_same_thread=False)
+        self.lock = threading.RLock()
+        self.db.execute('PRAGMA foreign_keys = ON')
+        self.db.executescript(schema)
+        # databases made before exports recorded the file's digest
+        if 'digest' not in [ column[1] for column in self.db.execute('PRAGMA table_info(exports)') ]:
+            self.db.execute('ALTER TABLE exports ADD COLUMN digest TEXT')
+
+    def query(self, sql, parameters=()):
+        with self.lock:
+            return self.db.execute(sql, parameters).fetchall()
+
+    def close(self):
+        self.db.close()
+
+    # Tests & Quizzes exports
+
+    def import_export(self, fname, item, encoding='auto', delimiter='auto'):
+        """Load every row of an export as submissions of item, replacing any
+earlier load of the same file. Exports are told apart by their absolute
+path, and one already loaded with the same contents is not read again."""
+        name = os.path.abspath(fname)
+        digest = file_digest(fname)
+        if self.query('SELECT 1 FROM exports WHERE item = ? AND source = ? AND digest = ?', (item, name, digest)):
+            return self.query('SELECT COUNT(*) FROM submissions WHERE item = ? AND source = ?', (item, name))[0][0]
+        source = CSVInput(fname, encoding, delimiter)
+        reader = source.reader()
+        fieldnames = next(reader)
+        fixed = { key: fieldnames.index(name) for key, name in fields.items() }
+        team = [ fieldnames.index(name) if name in fieldnames else None
+                 for name in ('Part 1, Question 1, Response', 'Part 1, Question 2, Response') ]
+        qids = [ question_id(field) or (None, None) for field in fieldnames ]
+
+        def cell(row, i):
+            return row[i] if i is not None and i < len(row) else None
+
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM submissions WHERE item = ? AND source = ?', (item, name))
+            self.db.execute('INSERT OR REPLACE INTO exports (item, source, fieldnames, encoding, delimiter, digest) '
+                            'VALUES (?, ?, ?, ?, ?, ?)',
+                            (item, name, json.dumps(fieldnames), source.encoding, source.delimiter, digest))
+            next_id = self.db.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM submissions').fetchone()[0]
+            submissions = []
+            responses = []
+            for number, row in enumerate(row for row in reader if row):
+                submission_id = next_id + number
+                order = cell(row, fixed['order'])
+                submissions.append((submission_id, item, name, number, len(row), cell(row, fixed['pid']),
+                                    cell(row, fixed['firstname']), cell(row, fixed['lastname']), order,
+                                    num_or_none(int, order), cell(row, team[0]), cell(row, team[1])))
+                responses.extend((submission_id, col, qids[col][0], qids[col][1], value)
+                                 for col, value in enumerate(row) if value and col not in fixed.values())
+            self.db.executemany('INSERT INTO submissions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', submissions)
+            self.db.executemany('INSERT INTO responses VALUES (?, ?, ?, ?, ?)', responses)
+        return len(submissions)
+
+    def export_export(self, item, fname, source=None, encoding=None, delimiter=None):
+        """Write the submissions of item loaded from source (which may be
+left out if item came from a single file) back out as an export, by
+default in the encoding and delimiter it was read with"""
+        if source:
+            source = os.path.abspath(source)
+        sources = self.query('SELECT source, fieldnames, encoding, delimiter FROM exports WHERE item = ?'
+                             + (' AND source = ?' if source else ''), (item, source) if source else (item,))
+        if len(sources) != 1:
+            raise KeyError('{}: {} exports, give the source file'.format(item, len(sources)) if sources else item)
+        source, fieldnames, stored_encoding, stored_delimiter = sources[0]
+        fieldnames = json.loads(fieldnames)
+        fixed = { key: fieldnames.index(name) for key, name in fields.items() }
+        rows = {}
+        for submission, width, pid, first_name, last_name, order in self.query(
+                'SELECT id, width, pid, first_name, last_name, submission_order FROM submissions '
+                'WHERE item = ? AND source = ? ORDER BY row', (item, source)):
+            row = [''] * width
+            for key, value in (('pid', pid), ('firstname', first_name), ('lastname', last_name), ('order', order)):
+                if fixed[key] < width:
+                    row[fixed[key]] = value
+            rows[submission] = row
+        for submission, col, value in self.query(
+                'SELECT r.submission, r.col, r.value FROM responses r JOIN submissions s ON s.id = r.submission '
+                'WHERE s.item = ? AND s.source = ?', (item, source)):
+            rows[submission][col] = value
+        with open(fname, 'w', newline='', encoding=encoding or stored_encoding) as f:
+            writer = csv.writer(f, delimiter=delimiter or stored_delimiter)
+            writer.writerow(fieldnames)
+            writer.writerows(rows.values())
+
+    # resolved reviews
+
+    def add_reviews(self, item, reviews):
+        """Replace the reviews of item. reviews holds (reviewer pid, reviewee
+pid, name as written, section, group, [ (question, result) ])."""
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM reviews WHERE item = ?', (item,))
+            next_id = self.db.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM reviews').fetchone()[0]
+            rows = []
+            answers = []
+            for number, (reviewer, reviewee, name, section, group, results) in enumerate(reviews):
+                rows.append((next_id + number, item, reviewer, reviewee, name, section, group))
+                answers.extend((next_id + number, question, None if result is None else str(result))
+                               for question, result in results)
+            self.db.executemany('INSERT INTO reviews VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+            self.db.executemany('INSERT INTO review_answers VALUES (?, ?, ?)', answers)
+
+    def reviews_received(self, pid, items=None):
+        """Reviews pid received, across all items or only those in items,
+as a list of dicts with item, reviewer, name and answers"""
+        sql = ('SELECT r.id, r.item, r.reviewer, r.name, a.question, a.result FROM reviews r '
+               'LEFT JOIN review_answers a ON a.review = r.id WHERE r.reviewee = ?')
+        parameters = [ pid ]
+        if items:
+            sql += ' AND r.item IN ({})'.format(', '.join('?' * len(items)))
+            parameters += list(items)
+        received = {}
+        for review, item, reviewer, name, question, result in self.query(sql + ' ORDER BY r.item, r.id', parameters):
+            entry = received.setdefault(review, { 'item': item, 'reviewer': reviewer, 'name': name, 'answers': {} })
+            if question is not None:
+                entry['answers'][question] = result
+        return list(received.values())
+
+    def missing_reviews(self, item):
+        """Students of item that didn't submit, or received fewer reviews
+than their team submitted, as (section, group, pid, submitted, reviews
+received, reviews expected)"""
+        return self.query('''
+            WITH members AS (SELECT section, grp, pid, MAX(attempt IS NOT NULL) AS submitted
+                             FROM submissions WHERE item = ? GROUP BY section, grp, pid),
+                 teams AS (SELECT section, grp, SUM(submitted) AS expected FROM members GROUP BY section, grp),
+                 received AS (SELECT reviewee, COUNT(DISTINCT reviewer) AS n FROM reviews
+                              WHERE item = ? GROUP BY reviewee)
+            SELECT m.section, m.grp, m.pid, m.submitted, COALESCE(r.n, 0), t.expected
+            FROM members m JOIN teams t ON t.section IS m.section AND t.grp IS m.grp
+            LEFT JOIN received r ON r.reviewee = m.pid
+            WHERE NOT m.submitted OR COALESCE(r.n, 0) < t.expected
+            ORDER BY m.section, m.grp, m.pid''', (item, item))
+
+    # aliases
+
+    def import_aliases(self, fname):
+        """Replace the aliases with those in an alias journal"""
+        aliases = {}
+        with open(fname, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    alias, real = parse_alias(line)
+                    aliases[alias] = real
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM aliases')
+            self.db.executemany('INSERT INTO aliases VALUES (?, ?)', aliases.items())
+
+    def export_aliases(self, fname):
+        with open(fname, 'w', encoding='utf-8') as f:
+            for alias, real in self.query('SELECT alias, real FROM aliases ORDER BY alias'):
+                f.write(format_alias(alias, real))
+
+    # gradebook
+
+    def import_gradebook(self, fname, encoding='auto', delimiter='auto'):
+        """Replace the stored gradebook with a gradebook CSV"""
+        source = CSVInput(fname, encoding, delimiter)
+        reader = source.reader()
+        fieldnames = next(reader)
+        layout = RowLayout(fieldnames)
+        students = []
+        scores = []
+        for position, cells in enumerate(row for row in reader if row):
+            row = GradebookRow(cells, layout)
+            students.append((row.student_id, position, row.student_name, normalize_name(row.student_name),
+                             row.section, json.dumps(cells)))
+            scores.extend((row.student_id, item_name, row.points_cell(item_name), row.comments_cell(item_name))
+                          for item_name in layout.items)
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM students')
+            self.db.execute('DELETE FROM scores')
+            self.db.execute('DELETE FROM gradebook')
+            self.db.executemany('INSERT INTO gradebook VALUES (?, ?)',
+                                (('fieldnames', json.dumps(fieldnames)), ('encoding', source.encoding),
+                                 ('delimiter', source.delimiter)))
+            self.db.executemany('INSERT OR REPLACE INTO students VALUES (?, ?, ?, ?, ?, ?)', students)
+            self.db.executemany('INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?)', scores)
+        return len(students)
+
+    def gradebook_setting(self, key):
+        rows = self.query('SELECT value FROM gradebook WHERE key = ?', (key,))
+        return rows[0][0] if rows else None
+
+    def update_scores(self, updates):
+        """Set scores from a dict of item name to a dict of pid to (points,
+comments), as given to patch_gradebook_items"""
+        with self.lock, self.db:
+            self.db.executemany('INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?)',
+                                ((pid, item_name, points_text(points), comments)
+                                 for item_name, scores in updates.items()
+                                 for pid, (points, comments) in scores.items()))
+
+    def export_gradebook(self, fname, encoding=None, delimiter=None):
+        """Write the stored gradebook, with its current scores, as a
+gradebook CSV"""
+        fieldnames = json.loads(self.gradebook_setting('fieldnames'))
+        layout = RowLayout(fieldnames)
+        rows = { pid: json.loads(cells) for pid, cells in self.query('SELECT pid, cells FROM students ORDER BY position') }
+        for pid, item_name, points, comments in self.query('SELECT pid, item, points, comments FROM scores'):
+            if pid not in rows or item_name not in layout.items:
+                continue
+            row = rows[pid]
+            for column, value in zip(layout.items[item_name], (points, comments)):
+                if column is not None:
+                    row.extend([''] * (column + 1 - len(row)))
+                    row[column] = value
+        with open(fname, 'w', newline='', encoding=encoding or self.gradebook_setting('encoding')) as f:
+            writer = csv.writer(f, delimiter=delimiter or self.gradebook_setting('delimiter'))
+            writer.writerow(fieldnames)
+            writer.writerows(rows.values())
+
+    def gradebook(self):
+        return StoreGradebook(self)
+
+class StoreGradebook:
+    """Read only Gradebook over a Store, records are looked up with indexed
+queries instead of being held in memory"""
+    def __init__(self, store):
+        self.store = store
+        fieldnames = json.loads(store.gradebook_setting('fieldnames'))
+        self.layout = RowLayout(fieldnames)
+        self.items = gradebook_items_from_fieldnames(fieldnames)
+        self._item_index = { item.name: item for item in self.items }
+
+    def get_item(self, item_name):
+        try:
+            return self._item_index[item_name]
+        except KeyError:
+            raise NoSuchItem(item_name)
+
+    def has_item(self, item_name):
+        return item_name in self._item_index
+
+    def row(self, pid, cells):
+        row = GradebookRow(json.loads(cells), self.layout)
+        for item_name, points, comments in self.store.query('SELECT item, points, comments FROM scores WHERE pid = ?', (pid,)):
+            if item_name in self.layout.items:
+                row.set_score(item_name, GradebookScore(points, comments))
+        return row
+
+    def record_for(self, attr_name, rvalue):
+        count('record_lookups')
+        attr_name = indexed_attrs.get(attr_name, attr_name)
+        if attr_name == 'student_id':
+            found = self.store.query('SELECT pid, cells FROM students WHERE pid = ?', (rvalue,))
+        elif attr_name == 'student_name' and isinstance(rvalue, str):
+            found = self.store.query('SELECT pid, cells FROM students WHERE normalized_name = ? ORDER BY position LIMIT 1',
+                                     (normalize_name(rvalue),))
+        else:
+            found = [ (pid, cells) for pid, cells in self.store.query('SELECT pid, cells FROM students ORDER BY position')
+                      if getattr(self.row(pid, cells), attr_name, None) == rvalue ][:1]
+        if not found:
+            raise NoSuchRecord(attr_name, rvalue)
+        return self.row(*found[0])
+
+    def records_in_section(self, section):
+        return [ self.row(pid, cells) for pid, cells in
+                 self.store.query('SELECT pid, cells FROM students WHERE section = ? ORDER BY position', (section,)) ]
+
+    @property
+    def records(self):
+        return [ self.row(pid, cells) for pid, cells in self.store.query('SELECT pid, cells FROM students ORDER BY position') ]
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Load CSV files into a review database, write them back out and query it')
+    parser.add_argument('db', help='SQLite database file')
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('import-export', help='load a Tests & Quizzes export as ITEM')
+    command.add_argument('fname')
+    command.add_argument('item')
+    command = commands.add_parser('export-export', help='write the export loaded for ITEM')
+    command.add_argument('item')
+    command.add_argument('fname')
+    command.add_argument('--source', help='path of the file the export was loaded from')
+    command = commands.add_parser('import-gradebook', help='load a gradebook CSV')
+    command.add_argument('fname')
+    command = commands.add_parser('export-gradebook', help='write the gradebook with its current scores')
+    command.add_argument('fname')
+    command = commands.add_parser('import-aliases', help='load an alias journal')
+    command.add_argument('fname')
+    command = commands.add_parser('export-aliases', help='write the aliases as a journal')
+    command.add_argument('fname')
+    command = commands.add_parser('received', help='reviews a student received')
+    command.add_argument('pid')
+    command.add_argument('items', nargs='*', help='only these items')
+    command = commands.add_parser('missing', help='students missing reviews for ITEM')
+    command.add_argument('item')
+    args = parser.parse_args()
+
+    store = Store(args.db)
+    if args.command == 'import-export':
+        print('{} submissions'.format(store.import_export(args.fname, args.item)))
+    elif args.command == 'export-export':
+        store.export_export(args.item, args.fname, args.source)
+    elif args.command == 'import-gradebook':
+        print('{} students'.format(store.import_gradebook(args.fname)))
+    elif args.command == 'export-gradebook':
+        store.export_gradebook(args.fname)
+    elif args.command == 'import-aliases':
+        store.import_aliases(args.fname)
+    elif args.command == 'export-aliases':
+        store.export_aliases(args.fname)
+    elif args.command == 'received':
+        for review in store.reviews_received(args.pid, args.items):
+            print('{item}: from {reviewer} as "{name}": {answers}'.format(**review))
+    elif args.command == 'missing':
+        for section, group, pid, submitted, received, expected in store.missing_reviews(args.item):
+            print('{}, Team {}: {} {}received {} of {} reviews'.format(section, group, pid,
+                                                                  '' if submitted else 'did not submit, ', received, expected))
+    store.close()
@@ -0,0 +1,124 @@
+import csv
+import random
+
+from scholar.gradebook import GradebookItem
+
+syllables = ( 'an', 'bel', 'cor', 'da', 'el', 'fin', 'gar', 'ha', 'is', 'jo', 'ka', 'lin', 'mar', 'no',
+              'or', 'pet', 'qui', 'ros', 'sa', 'tor', 'ul', 'ven', 'wil', 'xa', 'yor', 'zel' )
+section_times = ( '8:00 MWF', '9:00 MWF', '10:00 MWF', '12:30 TuTh', '2:00 TuTh', '3:30 TuTh' )
+review_item = "Manager's Review 2"
+
+class Student:
+    __slots__ = ('first_name', 'last_name', 'pid', 'section', 'group')
+
+    def __init__(self, first_name, last_name, pid, section, group):
+        self.first_name = first_name
+        self.last_name = last_name
+        self.pid = pid
+        self.section = section
+        self.group = group
+
+    @property
+    def full_name(self):
+        return '{} {}'.format(self.first_name, self.last_name)
+
+def make_name(rng, parts):
+    return ''.join(rng.choice(syllables) for _ in range(parts)).capitalize()
+
+def make_cohort(students, team_size=6, seed=0):
+    """Students with unique names, split into sections of teams of
+team_size"""
+    rng = random.Random(seed)
+    sections = section_times[:max(1, min(len(section_times), students // (team_size * 4)))]
+    names = set()
+    cohort = []
+    while len(cohort) < students:
+        first, last = make_name(rng, 2), make_name(rng, rng.choice((2, 3)))
+        if (first, last) in names:
+            continue
+        names.add((first, last))
+        i = len(cohort)
+        cohort.append(Student(first, last, 'pid{:06d}'.format(i), sections[i % len(sections)],
+                              str(i // (team_size * len(sections)) + 1)))
+    return cohort
+
+def teams(cohort):
+    result = {}
+    for student in cohort:
+        result.setdefault((student.section, student.group), []).append(student)
+    return result
+
+def typo(name, rng):
+    """name with one random letter substituted, dropped, doubled or
+swapped with its neighbour"""
+    i = rng.randrange(len(name) - 1)
+    if name[i] == ' ':
+        i += 1
+    edit = rng.randrange(4)
+    if edit == 0:
+        return name[:i] + rng.choice('aeiourstln') + name[i+1:]
+    elif edit == 1:
+        return name[:i] + name[i+1:]
+    elif edit == 2:
+        return name[:i] + name[i] + name[i:]
+    return name[:i] + name[i+1] + name[i] + name[i+2:]
+
+def export_header(team_size):
+    header = [ 'Last Name', 'First Name', 'User Name', 'Order of Submission (1=first)',
+               'Part 1, Question 1, Response', 'Part 1, Question 2, Response' ]
+    for part in range(2, team_size + 2):
+        for question in range(1, 7):
+            header.append('Part {}, Question {}, Response'.format(part, question))
+    return header
+
+def write_export(fname, cohort, team_size=6, encoding='utf-8', delimiter=',', typo_rate=0.1,
+                 resubmit_rate=0.05, skip_rate=0.05, seed=0):
+    """Write a Tests & Quizzes export in which every student reviews each
+member of their team. Some reviewee names get a typo, some students submit
+twice and some never submit."""
+    rng = random.Random(seed)
+    with open(fname, 'w', encoding=encoding, newline='') as f:
+        writer = csv.writer(f, delimiter=delimiter)
+        writer.writerow(export_header(team_size))
+        for (section, group), members in teams(cohort).items():
+            for student in members:
+                row = [ student.last_name, student.first_name, student.pid ]
+                if rng.random() < skip_rate:
+                    writer.writerow(row + [ '', section, group ] + [ 'No Answer', '', '', '', '', '' ] * team_size)
+                    continue
+                attempts = 2 if rng.random() < resubmit_rate else 1
+                for attempt in range(1, attempts + 1):
+                    cells = row + [ str(attempt), section, group ]
+                    for part in range(team_size):
+                        if part < len(members):
+                            name = members[part].full_name
+                            if rng.random() < typo_rate:
+                                name = typo(name, rng)
+                            cells += [ 'A. ' + name ] + [ str(rng.randint(0, 3)) for _ in range(4) ]
+                            cells.append('Comments on {}'.format(members[part].first_name))
+                        else:
+                            cells += [ 'No Answer', '', '', '', '', '' ]
+                    writer.writerow(cells)
+
+def write_gradebook(fname, cohort, items=10, encoding='utf-8', delimiter=',', seed=0):
+    """Write a no structure gradebook for cohort with items grade items,
+one of which is review_item"""
+    rng = random.Random(seed)
+    gbitems = [ GradebookItem('Assignment {}'.format(i), None, 10) for i in range(1, items) ]
+    gbitems.insert(min(1, len(gbitems)), GradebookItem(review_item, ['R'], 10))
+    header = [ 'Student Id', 'Student Name', 'Section' ]
+    for item in gbitems:
+        header += [ item.label, item.comment_label ]
+    header += [ 'Letter Grade', 'Total Points', 'Calculated Grade' ]
+    with open(fname, 'w', encoding=encoding, newline='') as f:
+        writer = csv.writer(f, delimiter=delimiter)
+        writer.writerow(header)
+        for student in cohort:
+            row = [ student.pid, '{}, {}'.format(student.last_name, student.first_name), student.section ]
+            for item in gbitems:
+                if item.name == review_item:
+                    row += [ '', '' ]
+                else:
+                    row += [ str(rng.randint(5, 10)), rng.choice(('', 'ok', 'Late')) ]
+            row += [ 'A', str(rng.randint(60, 100)), '{}%'.format(rng.randint(60, 100)) ]
+            writer.writerow(row)
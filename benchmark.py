@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from app import synthetic
+from app.corrector import Corrector
+from manager_review import read_reviews, name_finder, match_reviewees, add_responses, response_filter, reviewee_key
+from scholar import tests_quizzes as tq
+from scholar.gradebook import Gradebook
+
+export_variants = { 'utf8': ('utf-8', ','), 'utf16': ('utf-16', '\t') }
+
+def best_of(repeat, fn, setup=None):
+    """Best wall clock time in seconds of repeat calls to fn, each given
+the result of a fresh call to setup (untimed)"""
+    times = []
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        start = time.perf_counter()
+        fn(arg) if setup else fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def generate(directory, students, items, seed=0):
+    """Write the synthetic export variants and gradebook for one size,
+return their file names"""
+    cohort = synthetic.make_cohort(students, seed=seed)
+    files = {}
+    for variant, (encoding, delimiter) in export_variants.items():
+        files[variant] = os.path.join(directory, 'export_{}_{}.txt'.format(students, variant))
+        synthetic.write_export(files[variant], cohort, encoding=encoding, delimiter=delimiter, seed=seed)
+    files['gradebook'] = os.path.join(directory, 'gradebook_{}_{}.csv'.format(students, items))
+    synthetic.write_gradebook(files['gradebook'], cohort, items, seed=seed)
+    return files
+
+def bench_size(directory, students, items, repeat, seed=0):
+    files = generate(directory, students, items, seed)
+    results = {}
+    for variant, (encoding, delimiter) in export_variants.items():
+        results['parse_' + variant] = best_of(repeat, lambda: tq.QuizSubmissions(files[variant],
+                                                                                  response_filter=response_filter,
+                                                                                  encoding=encoding,
+                                                                                  delimiter=delimiter,
+                                                                                  stream=True).latest)
+
+    def load():
+        return read_reviews(files['utf8'], 'utf-8', ',', 3)
+    reviews, responses = load()
+    names = [ review.full_name.lower().strip() for review in reviews ]
+    queries = sorted(set(reviewee_key(response)[0] for response in responses))
+    corrector = Corrector(names)
+    results['corrector_build'] = best_of(repeat, lambda: Corrector(names))
+    results['corrector_correct'] = best_of(repeat, lambda: [ corrector.correct(query) for query in queries ])
+    results['people_finder'] = best_of(repeat, lambda: match_reviewees(responses, reviews, name_finder(reviews, None)))
+
+    def resolved():
+        reviews, responses = load()
+        return reviews, responses, match_reviewees(responses, reviews, name_finder(reviews, None))[0]
+    def aggregate(loaded):
+        reviews, responses, found = loaded
+        add_responses([ response for response in responses if reviewee_key(response) in found ], found)
+        reviews[0].cohort.subtotals
+    results['aggregate'] = best_of(repeat, aggregate, resolved)
+
+    gradebook = Gradebook(files['gradebook'], 'r')
+    gradebook.update_items({ synthetic.review_item: reviews })
+    output = os.path.join(directory, 'gradebook_out.csv')
+    results['gradebook_write'] = best_of(repeat, lambda: gradebook.write(output))
+    return { 'students': students, 'items': items, 'responses': len(responses), 'seconds': results }
+
+def version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def compare(previous, current):
+    """Print the ratio of each timing to the same timing in previous"""
+    before = { (r['students'], r['items']): r['seconds'] for r in previous['results'] }
+    for result in current['results']:
+        old = before.get((result['students'], result['items']))
+        if not old:
+            continue
+        for phase, seconds in result['seconds'].items():
+            if old.get(phase):
+                print('{:>6} {:>4} {:<18} {:8.4f}s  x{:.2f}'.format(result['students'], result['items'],
+                                                                   phase, seconds, seconds / old[phase]))
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Time the manager's review pipeline on synthetic cohorts")
+    parser.add_argument('--students', '-s', type=int, nargs='+', default=[ 100, 1000, 5000 ],
+                        help='Cohort sizes to generate')
+    parser.add_argument('--items', '-n', type=int, nargs='+', default=[ 10, 100 ],
+                        help='Number of gradebook items to generate')
+    parser.add_argument('--repeat', '-r', type=int, default=3, help='Runs per timing, the best is kept')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', '-o', default='benchmark.json', help='JSON file to write results to')
+    parser.add_argument('--compare', help='Earlier results to compare against')
+    parser.add_argument('--directory', '-d', help='Keep the generated files in this directory')
+    args = parser.parse_args()
+
+    report = { 'version': version(),
+               'date': datetime.now().isoformat(timespec='seconds'),
+               'python': platform.python_version(),
+               'results': [] }
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = args.directory or tmp
+        os.makedirs(directory, exist_ok=True)
+        for students in args.students:
+            for items in args.items:
+                sys.stderr.write('{} students, {} items\n'.format(students, items))
+                report['results'].append(bench_size(directory, students, items, args.repeat, args.seed))
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,29 @@
 #!/usr/bin/env python3
 
 from sys import stdout, stderr
-from itertools import groupby
+import sys
+import csv
 import textwrap
+import os
 from os import name as os_name
 from datetime import datetime
+from collections import deque
+from contextlib import closing, contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
+from app.cache import ParseCache
+from app.cohort import CohortScores
 from app.corrector import Corrector
-from app.person import people_finder
+from app.policy import Policy, PolicyError
+from app.profiler import Profiler
+from app.session import SessionLog, session_name
+from app.store import Store
+from app.person import people_finder, name_prompt
 from scholar import tests_quizzes as tq
-from scholar.gradebook import open_gradebook, Gradebook, NoSuchRecord, NoSuchItem
+from scholar.csvinput import EncodingError
+import scholar.csvinput
+import scholar.gradebook
+from scholar.gradebook import patch_gradebook_items, Gradebook, NoSuchRecord, NoSuchItem
 from scholar.person import Person
 from util import flatten_list, label_to_attr, num_or_none
 
@@ -23,9 +37,13 @@ question_number_map = { 2: 'Interdependence',
                     }
 
 review_attrs = [ label_to_attr(v) for v in question_number_map.values() ]
+prefetch_depth = 4 # reviews prepared ahead of the one being graded
+
+score_labels = [ label for label in question_number_map.values() if not label == 'Comments' ]
 
 class ManagersReview(Person):
-    """A manager's review for a single person"""
+    """A manager's review for a single person, a view over one row of a
+CohortScores array"""
     def __init__(self, fname, lname, pid, **kwargs):
         self.first_name = fname
         self.last_name = lname
@@ -37,16 +55,22 @@ class ManagersReview(Person):
             self.section = response.responses(1,1).result
             self.group = response.responses(1,2).result
         self.submission_points = 0.0
+        self.submitted = False
         self.comments = ""
         self.__instructor_points = 0
         self.labels = [ quality for quality in question_number_map.values() ]
-        for quality in self.labels:
-            setattr(self, '_' + label_to_attr(quality), [])
-            
+        self.cohort = kwargs.pop('cohort', None) or CohortScores(score_labels)
+        self.row = self.cohort.add_student()
+        self._comments = []
+
     def add_reviews(self, reviews):
         for r in reviews:
             self.add_review(r)
     @property
+    def reviews_received(self):
+        return int(self.cohort.raters[self.row])
+
+    @property
     def peer_comments(self):
         return self._comments
     
@@ -55,25 +79,25 @@ class ManagersReview(Person):
             self.section = review.section
         if review.group is not None:
             self.group = review.group    
-        for rr in review.reviews:
-            label = '_' + label_to_attr(question_number_map[rr[0]])
-            attr = getattr(self, label)
-            attr.append(rr[1])
-            setattr(self, label, attr)
+        rater = self.cohort.add_rater(self.row)
+        for question, result in review.reviews:
+            label = question_number_map[question]
+            if label == 'Comments':
+                self._comments.append(result)
+            else:
+                self.cohort.set_score(self.row, label, rater, result)
 
     def __getitem__(self, label):
-        return getattr(self, '_' + label_to_attr(label))
+        if label == 'Comments':
+            return self._comments
+        return self.cohort.scores_for(self.row, label)
 
     @property
     def scores(self):
-        return { label: self.score_for(label) for label in self.labels if not label == 'Comments' }
+        return dict(zip(self.cohort.qualities, self.cohort.means[self.row]))
 
     def score_for(self, label):
-        scores = [ score for score in self.__getitem__(label) if score is not None ]
-        try:
-            return sum(scores)/len(scores)
-        except ZeroDivisionError:
-            return 0
+        return self.scores[label]
 
     @property
     def instructor_points(self):
@@ -88,7 +112,7 @@ class ManagersReview(Person):
 
     @property
     def peer_score(self):
-        return sum(self.scores.values())
+        return self.cohort.subtotals[self.row]
 
     @property
     def points(self):
@@ -109,10 +133,11 @@ class ManagersReview(Person):
     
 class ManagersReviewResponse():
     
-    def __init__(self, responses, section, group):
+    def __init__(self, responses, section, group, reviewer=None):
         self.full_name = [ response.result for response in responses if response.question == 1 ][0]
         self.section = section
         self.group = group
+        self.reviewer = reviewer
         #super().__init__(fname, lname, pid)
         self.reviews = [ (response.question,response.result) for response in responses if response.question > 1 ]
         
@@ -128,7 +153,7 @@ class ManagersReviewSubmission(Person):
         self.submission = submission
         self.section = self.submission.responses(1,1).result
         self.group = self.submission.responses(1,2).result
-        self.reviews = [ ManagersReviewResponse(self.submission.responses(p), self.section, self.group) for p in range(2,8) if has_name(p) ]
+        self.reviews = [ ManagersReviewResponse(self.submission.responses(p), self.section, self.group, self.pid) for p in range(2,8) if has_name(p) ]
         self.submitted = num_or_none(int, submission.submission_order) is not None
         
     def review_for(self, name):
@@ -158,91 +183,217 @@ def name_collector(result, fuzzy_filter):
     name = result.response(p,1).response.lower().strip()
     return fuzzy_filter(name).full_name
 
-def prompt_for_score(review):
+class ConsoleUI:
+    """Command line front end: prompts use input() and progress is not
+shown. The GUI supplies its own object with the same methods."""
+    def progress(self, phase, done, total=None):
+        pass
+
+    def show(self, text):
+        print(text)
+
+    def error(self, text):
+        """Report a problem the user has to act on"""
+        stderr.write(text + '\n')
+
+    def ask(self, prompt):
+        return input(prompt)
+
+    def name_prompt(self, prompt, people, name, names=None):
+        return name_prompt(prompt, people, name, ask=self.ask, show=self.show, names=names)
+
+def prompt_for_score(review, ui):
     instructor_score = 0
     if os_name == 'nt':
-        print("Press Ctrl+C and then Enter to quit (changes will be saved)")
+        ui.show("Press Ctrl+C and then Enter to quit (changes will be saved)")
     while instructor_score == 0:
         instructor_prompt = 'Instructor score for {}'.format(review.full_name)
         if review.instructor_points > 0:
             instructor_prompt += ' ({:0.1f})'.format(review.instructor_points)
         instructor_prompt += ':'
                 
-        instructor_input = input(instructor_prompt)
+        instructor_input = ui.ask(instructor_prompt)
 
         try:
             instructor_score = float(instructor_input)
         except ValueError:
             if len(instructor_input) == 0 and review.instructor_points > 0:
                 return review.instructor_points
-            stderr.write("'{}' is not a number\n".format(instructor_input))
+            ui.show("'{}' is not a number".format(instructor_input))
     return instructor_score
 
-def prompt_for_comments(review, args):
+def prompt_for_comments(review, args, ui):
     if args.comments:
         if len(review.comments.strip()) > 0:
-            print('Current instructor comments: "{}"'.format(review.comments))
-        instructor_comments = input('Instructor comments for {}: '.format(review.full_name))
+            ui.show('Current instructor comments: "{}"'.format(review.comments))
+        instructor_comments = ui.ask('Instructor comments for {}: '.format(review.full_name))
         return instructor_comments
     
-def collect_responses(responses, reviews, reviewee, gradebook, args):
-    for k, g in groupby(sorted(responses, key=reviewee), reviewee):
-        review = [ review for review in reviews if review.full_name.lower().strip() == k ][0]
-        review.add_reviews(g)
+def reviewee_key(response):
+    return (response.full_name.lower().strip(), response.section, response.group)
+
+def match_reviewees(responses, reviews, find_people):
+    """Resolve each distinct reviewee name once without prompting.
+Returns a dict from reviewee_key to ManagersReview for the names that
+were matched, and a dict from reviewee_key to a response for the rest."""
+    resolved = {}
+    unresolved = {}
+    for response in responses:
+        key = reviewee_key(response)
+        if key in resolved or key in unresolved:
+            continue
+        found = find_people.match(reviews, key[0], response)
+        if len(found) == 1:
+            resolved[key] = found[0]
+        else:
+            unresolved[key] = response
+    return resolved, unresolved
+
+def resolve_reviewees(responses, reviews, find_people, ui):
+    """Resolve each distinct reviewee name once. Names that can't be
+matched automatically are prompted for together after all the others
+are resolved. Returns a dict from reviewee_key to ManagersReview."""
+    resolved, unresolved = match_reviewees(responses, reviews, find_people)
+    total = len(resolved) + len(unresolved)
+    ui.progress('resolve', len(resolved), total)
+    if unresolved:
+        ui.show("{} reviewee names need to be matched".format(len(unresolved)))
+    for key, response in unresolved.items():
+        resolved[key] = find_people(reviews, response.full_name, review=response)
+        ui.progress('resolve', len(resolved), total)
+    return resolved
+
+def add_responses(responses, resolved):
+    for response in responses:
+        resolved[reviewee_key(response)].add_review(response)
+
+def reviewed_pairs(responses, resolved):
+    """(response, reviewee pid) for each resolved response"""
+    return [ (response, resolved[reviewee_key(response)].pid) for response in responses
+             if reviewee_key(response) in resolved ]
+
+def load_score(review, gradebook, args):
+    """Set review's points and comments from the gradebook"""
+    if gradebook is None:
+        return
+    record = gradebook.record_for('student_id', review.pid)
+    score = record.score_for(args.name)
+    try:
+        review.points = score.points
+    except TypeError:
+        pass
+
+    review.comments = score.comments
+
+def render_review(review, ui=None):
+    """The block of text shown for a review before the instructor prompt"""
+    ui = ui or ConsoleUI()
+    lines = [ "{} ({}, Team {})".format(review.full_name, review.section, review.group) ]
+    for label,score in review.scores.items():
+        lines.append("\t{}: {:0.1f}".format(label,score))
+    lines.append("\t")
+    for comment in review.peer_comments:
+        try:
+            comment_lines = textwrap.wrap('"{}"'.format(comment),72)
+        except (AttributeError, TypeError) as e:
+            ui.error('{}: {}: attempt to wrap "{}"'.format(type(e).__name__, review.full_name, comment))
+        else:
+            for comment in comment_lines:
+                lines.append('\t{}'.format(comment.encode(conencoding, errors='replace').decode(conencoding)))
+
+    lines.append("\t")
+    lines.append("\tpeer subtotal: {:0.2f}".format(review.peer_score))
+    lines.append("\tsubmission: {}".format(review.submission_points))
+    return '\n'.join(lines)
+
+def prepare_review(review, gradebook, args, ui=None):
+    load_score(review, gradebook, args)
+    return render_review(review, ui)
+
+def prefetch(reviews, prepare, depth):
+    """Yield (review, prepare(review)) for each review, preparing up to
+depth reviews ahead on a background thread while the caller waits on
+the instructor"""
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        pending = deque()
+        reviews = iter(reviews)
+        for review in reviews:
+            pending.append((review, executor.submit(prepare, review)))
+            if len(pending) > depth:
+                break
+        while pending:
+            review, future = pending.popleft()
+            for review_ahead in reviews:
+                pending.append((review_ahead, executor.submit(prepare, review_ahead)))
+                break
+            yield review, future.result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def collect_responses(reviews, gradebook, args, policy=None, session=None, ui=None):
+    """Print each review and, when interactive, ask for the instructor's
+score and comments. Students already in the session log are restored
+from it and skipped. Returns False if the user quit early."""
+    ui = ui or ConsoleUI()
 
     def section_team_name(review):
         return review.section + review.group + review.full_name
+
+    if policy is not None:
+        team_medians = policy.team_medians(reviews)
+        escalated = []
+
+    def prepare(review):
+        return prepare_review(review, gradebook, args, ui)
     
-    for review in sorted(reviews, key=section_team_name):
-        print("")
-        record = [ record for record in gradebook.records if record.pid == review.pid][0]
-        score = record.score_for(args.name)
-        try:
-            review.points = score.points
-        except TypeError:
-            pass
-        
-        review.comments = score.comments
+    # closed before returning, so a quit waits for the prefetch thread
+    # before anything is written
+    with closing(prefetch(sorted(reviews, key=section_team_name), prepare, prefetch_depth)) as prepared:
+        for graded, (review, block) in enumerate(prepared):
+            ui.progress('grade', graded, len(reviews))
+            if session is not None and review.pid in session:
+                review.instructor_points, review.comments = session[review.pid]
+                continue
+
+            ui.show("")
+            interactive = args.interactive
+            if policy is not None:
+                rule = policy.apply(review, team_medians)
+                interactive = interactive and rule is not None and rule.escalate
+                if rule is not None and rule.escalate:
+                    escalated.append(review)
         
-        print("{} ({}, Team {})".format(review.full_name, review.section, review.group))
-        for label,score in review.scores.items():
-            print("\t{}: {:0.1f}".format(label,score))
-        print("\t")
-        for comment in review.peer_comments:
-            try:
-                comment_lines = textwrap.wrap('"{}"'.format(comment),72)
-            except AttributeError:
-                stderr.write('AttributeError: {}, {}: attempt to wrap "{}"\n'.format(person.full_name, label, comment).encode('utf-8'))
-            except TypeError:
-                stderr.write('TypeError: {}, {}: attempt to wrap "{}"\n'.format(person.full_name, label, comment).encode('utf-8'))
-            else:
-                for comment in comment_lines:
-                    print('\t{}'.format(comment.encode(conencoding, errors='replace').decode(conencoding)))
-
-        peer_subtotal = sum(review.scores.values())
-        print("\t")
-        print("\tpeer subtotal: {:0.2f}".format(peer_subtotal))
-        print("\tsubmission: {}".format(review.submission_points))
-        if args.interactive:
-            try:
-                instructor_score = prompt_for_score(review)
-            except (KeyboardInterrupt, EOFError):
-                print("")
-                return
-            else:
-                review.instructor_points = instructor_score
-
-            try:
-                instructor_comments = prompt_for_comments(review, args)
-            except (KeyboardInterrupt, EOFError):
-                print("")
-                return
-            else:
-                if len(instructor_comments) > 0:
-                    review.comments =  instructor_comments
+            ui.show(block)
+            if interactive:
+                try:
+                    instructor_score = prompt_for_score(review, ui)
+                except (KeyboardInterrupt, EOFError):
+                    ui.show("")
+                    return False
+                else:
+                    review.instructor_points = instructor_score
+
+                try:
+                    instructor_comments = prompt_for_comments(review, args, ui)
+                except (KeyboardInterrupt, EOFError):
+                    ui.show("")
+                    return False
+                else:
+                    if instructor_comments:
+                        review.comments =  instructor_comments
+
+                if session is not None:
+                    session.record(review.pid, review.instructor_points, review.comments)
                 
-        print("Total points for {}: {}".format(review.full_name, review.points))
-            #print("{}: {}".format(result.full_name, [ result.response(p,1).response for p in range(2,8) ]))
+            ui.show("Total points for {}: {}".format(review.full_name, review.points))
+
+    ui.progress('grade', len(reviews), len(reviews))
+    if policy is not None and escalated and not args.interactive:
+        ui.error('{} students matched an escalate rule and need review:'.format(len(escalated)))
+        for review in escalated:
+            ui.error('\t{} ({}, Team {})'.format(review.full_name, review.section, review.group))
+    return True
 
 def dump_reviews(fname, reviews):
     def quote(s):
@@ -253,77 +404,359 @@ def dump_reviews(fname, reviews):
         for review in reviews:
             f.write(','.join([review.pid, review.points, quote(review.comments)]) + '\n')
             
-def run(args):
-    qs = tq.QuizSubmissions(args.input_file,
-                            response_filter=response_filter,
-                            encoding=args.input_file_encoding,
-                            delimiter=args.input_file_delimiter)
-
-    reviews = [ ManagersReview(r.first_name, r.last_name, r.pid, response=r) for r in qs.latest ]
-    submissions = [ ManagersReviewSubmission(result) for result in qs.latest if num_or_none(int,result.submission_order) is not None ]
-
-    for submission in submissions:
-        review = [ review for review in reviews if review.full_name == submission.full_name ][0]
-        review.submission_points = args.submission_points
-
-    gradebook = None
-    if args.gradebook and args.name:
+def load_scores(fname):
+    """Read a pid,points,comments file as written by dump_reviews into a
+dict of pid to (points, comments)"""
+    with open(fname, 'r', newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        if not set(('pid', 'points', 'comments')) <= set(reader.fieldnames or ()):
+            raise ValueError('expected pid, points and comments columns')
+        return { row['pid']: (row['points'], row['comments']) for row in reader }
+
+def read_updates(args, gradebook, ui=None):
+    """Scores for each ITEM=FILE given with --update, read and checked
+against gradebook before grading starts. Errors are reported and None is
+returned."""
+    ui = ui or ConsoleUI()
+    updates = {}
+    for update in getattr(args, 'update', None) or []:
+        item_name, _, fname = update.rpartition('=')
+        if not item_name:
+            ui.error('{}: expected ITEM=FILE'.format(update))
+            return None
+        if item_name == args.name:
+            ui.error("{}: is the item being graded, it can't also be given with --update".format(item_name))
+            return None
+        if gradebook is not None and not gradebook.has_item(item_name):
+            ui.error('{}: no such item in gradebook'.format(item_name))
+            return None
         try:
-            gradebook = Gradebook(args.gradebook, 'r', encoding=args.gradebook_encoding, delimiter=args.gradebook_delimiter)
-        except FileNotFoundError as e:
-            stderr.write('No such file: {}\n'.format(args.gradebook))
-
-        if not gradebook.has_item(args.name):
-            stderr.write('{}: no such item in gradebook\n'.format(args.name))
-            return
-            
-    name_corrector = Corrector( [ review.full_name.lower().strip() for review in reviews ], alias=args.aliases )
-    find_people=people_finder(name_corrector)
-
-    def reviewee(review):
-        #return review.full_name
-        return find_people([r for r in reviews], review.full_name, review=review).full_name.lower().strip()
+            updates[item_name] = load_scores(fname)
+        except (OSError, ValueError) as e:
+            ui.error('{}: {}'.format(fname, getattr(e, 'strerror', None) or e))
+            return None
+        for pid, (points, _) in updates[item_name].items():
+            try:
+                float(points)
+            except (TypeError, ValueError):
+                ui.error("{}: {}: points '{}' is not a number".format(fname, pid, points))
+                return None
+    return updates
+
+def item_updates(args, reviews, updates):
+    """Gradebook updates for this run: the reviews for args.name plus
+the updates read by read_updates"""
+    result = { args.name: { review.pid: (review.points, review.comments) for review in reviews } }
+    result.update(updates)
+    return result
+
+def open_cache(cache_dir):
+    """ParseCache in cache_dir, None if caching is turned off"""
+    if not cache_dir:
+        return None
+    return ParseCache(cache_dir, parsers=(tq, scholar.csvinput, scholar.gradebook, sys.modules[__name__]))
+
+def read_reviews(input_file, encoding, delimiter, submission_points, cache_dir=None, profiler=None):
+    """Parse a Tests & Quizzes export into a ManagersReview for each
+student and the list of responses they submitted"""
+    profiler = profiler or Profiler(enabled=False)
+
+    def parse():
+        return tq.QuizSubmissions(input_file,
+                                  response_filter=response_filter,
+                                  encoding=encoding,
+                                  delimiter=delimiter,
+                                  stream=True)
+    with profiler.phase('parse'):
+        cache = open_cache(cache_dir)
+        if cache is not None:
+            qs = cache.load(input_file, 'submissions', parse, encoding=encoding, delimiter=delimiter)
+        else:
+            qs = parse()
+    with profiler.phase('latest'):
+        latest = qs.latest
+        cohort = CohortScores(score_labels, students=len(latest))
+        reviews = [ ManagersReview(r.first_name, r.last_name, r.pid, response=r, cohort=cohort) for r in latest ]
+        submissions = [ ManagersReviewSubmission(result) for result in latest if result.attempt is not None ]
+
+    reviews_by_pid = { review.pid: review for review in reviews }
+    for submission in submissions:
+        reviews_by_pid[submission.pid].submission_points = submission_points
+        reviews_by_pid[submission.pid].submitted = True
+
+    return reviews, flatten_list([ submission.reviews for submission in submissions ])
+
+def name_finder(reviews, aliases, ui=None, read_only=False):
+    corrector = Corrector( [ review.full_name.lower().strip() for review in reviews ], alias=aliases,
+                           read_only=read_only )
+    if ui is None:
+        return people_finder(corrector)
+    return people_finder(corrector, prompt=ui.name_prompt)
+
+def score_export(input_file, encoding, delimiter, submission_points, aliases, cache_dir=None):
+    """Parse one export and add every response whose reviewee can be
+matched without prompting. Returns the reviews, the responses that are
+still unresolved and the (response, reviewee pid) pairs that were. The
+alias journal is only read, exports are scored in parallel worker
+processes and the parent compacts it once they are done."""
+    reviews, responses = read_reviews(input_file, encoding, delimiter, submission_points, cache_dir)
+    resolved, unresolved = match_reviewees(responses, reviews, name_finder(reviews, aliases, read_only=True))
+    add_responses([ response for response in responses if reviewee_key(response) in resolved ], resolved)
+    return (reviews, [ response for response in responses if reviewee_key(response) in unresolved ],
+            reviewed_pairs(responses, resolved))
+
+def open_store(args):
+    """Store given with --db, None without it"""
+    if not getattr(args, 'db', None):
+        return None
+    return Store(args.db)
+
+def record_reviews(store, args, input_files, reviewed):
+    """Save the exports, the (response, reviewee pid) pairs in reviewed
+and the aliases of this run in store"""
+    for input_file in input_files:
+        store.import_export(input_file, args.name, args.input_file_encoding, args.input_file_delimiter)
+    store.add_reviews(args.name, [ (response.reviewer, pid, response.full_name, response.section, response.group,
+                                    response.reviews) for response, pid in reviewed ])
+    if args.aliases and os.path.exists(args.aliases):
+        store.import_aliases(args.aliases)
+
+def read_gradebook(args, store=None, ui=None):
+    """Open the gradebook for reading current scores, None if there is no
+gradebook or it lacks the item being graded. With a store the gradebook
+is loaded into it and scores are looked up there."""
+    ui = ui or ConsoleUI()
+    if not (args.gradebook and args.name):
+        return None
+    def parse():
+        return Gradebook(args.gradebook, 'r', encoding=args.gradebook_encoding, delimiter=args.gradebook_delimiter)
+    cache = open_cache(getattr(args, 'cache_dir', None))
+    try:
+        if store is not None:
+            store.import_gradebook(args.gradebook, args.gradebook_encoding, args.gradebook_delimiter)
+            gradebook = store.gradebook()
+        elif cache is not None:
+            gradebook = cache.load(args.gradebook, 'gradebook', parse,
+                                   encoding=args.gradebook_encoding, delimiter=args.gradebook_delimiter)
+        else:
+            gradebook = parse()
+    except FileNotFoundError as e:
+        ui.error('No such file: {}'.format(args.gradebook))
+        return None
+    except EncodingError as e:
+        ui.error(e.message)
+        return None
 
-    responses = flatten_list([ submission.reviews for submission in submissions ])
-    #for response in sorted(responses, key=reviewee):
-    #    print(response)
-    #sys.exit(0)
+    if not gradebook.has_item(args.name):
+        ui.error('{}: no such item in gradebook'.format(args.name))
+        return None
+    return gradebook
 
-    collect_responses(responses, reviews, reviewee, gradebook, args)
+def load_policy(args, ui=None):
+    """The scoring Policy given with --policy, or None. Errors reading it
+are reported and re-raised."""
+    if not getattr(args, 'policy', None):
+        return None
+    try:
+        return Policy.from_file(args.policy)
+    except (OSError, PolicyError) as e:
+        (ui or ConsoleUI()).error(str(e))
+        raise
+
+def open_session(args, input_files, ui=None):
+    """Session log for an interactive run, resuming any earlier session
+for the same input and item"""
+    if not args.interactive:
+        return None
+    session = SessionLog(session_name(input_files, args.name))
+    if session.entries:
+        (ui or ConsoleUI()).show("Resuming session, {} students already graded".format(len(session.entries)))
+    return session
+
+def grade(reviews, gradebook, args, policy=None, session=None, ui=None, profiler=None, store=None, updates=None):
+    """Run the review phase and record the results, False if they could
+not be written to the gradebook"""
+    ui = ui or ConsoleUI()
+    profiler = profiler or Profiler(enabled=False)
+    with profiler.phase('grade'):
+        completed = collect_responses(reviews, gradebook, args, policy, session, ui)
     
-    dump_reviews('reviews_backup_{}.csv'.format(datetime.now().strftime('%Y%m%d_%H%M%S')), reviews)
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    with profiler.phase('backup'):
+        dump_reviews('reviews_backup_{}.csv'.format(timestamp), reviews)
     if args.gradebook and args.name:
-        with open_gradebook(args.gradebook, 'w') as gradebook:
+        updates = item_updates(args, reviews, updates or {})
+        ui.progress('write', 0, 1)
+        try:
+            with profiler.phase('write'):
+                patch_gradebook_items(args.gradebook, updates,
+                                      encoding=args.gradebook_encoding, delimiter=args.gradebook_delimiter,
+                                      backup='gradebook_backup_{}.csv'.format(timestamp))
+        except (NoSuchRecord, NoSuchItem, EncodingError) as e:
+            ui.error(e.message)
+            dump_file = 'reviews_abort_on_gradebook_error.csv'
+            dump_reviews(dump_file, reviews)
+            ui.error('Grades and comments written to {}'.format(dump_file))
+            return False
+        else:    
+            if store is not None:
+                store.update_scores(updates)
+            ui.progress('write', 1, 1)
+            ui.show("{} written to {}, item name{} {}".format('Grades and comments' if args.comments else 'Grades',
+                                                             args.gradebook, 's' if len(updates) > 1 else '',
+                                                             ', '.join("'{}'".format(name) for name in updates)))
+    if completed and session is not None:
+        session.remove()
+    return True
+
+@contextmanager
+def open_profiler(args, ui):
+    """Profiler for a run with --profile, its summary is shown when the
+run ends"""
+    stats_file = getattr(args, 'profile_stats', None)
+    profiler = Profiler(enabled=getattr(args, 'profile', False) or bool(stats_file), stats_file=stats_file)
+    try:
+        yield profiler
+    finally:
+        if profiler.enabled:
+            profiler.finish()
+            ui.show(profiler.report())
+
+def run(args, ui=None):
+    """Grade one export. Returns False if the run failed, after reporting
+why through ui."""
+    ui = ui or ConsoleUI()
+    try:
+        policy = load_policy(args, ui)
+    except (OSError, PolicyError):
+        return False
+    store = open_store(args)
+    with open_profiler(args, ui) as profiler:
+        ui.progress('parse', 0)
+        try:
+            reviews, responses = read_reviews(args.input_file, args.input_file_encoding, args.input_file_delimiter,
+                                              args.submission_points, getattr(args, 'cache_dir', None), profiler)
+        except EncodingError as e:
+            ui.error(e.message)
+            return False
+        ui.progress('parse', len(reviews), len(reviews))
+
+        with profiler.phase('parse'):
+            gradebook = read_gradebook(args, store, ui)
+            updates = read_updates(args, gradebook, ui)
+        if (args.gradebook and args.name and gradebook is None) or updates is None:
+            return False
+
+        with profiler.phase('resolve'):
+            resolved = resolve_reviewees(responses, reviews, name_finder(reviews, args.aliases, ui), ui)
+        with profiler.phase('aggregate'):
+            add_responses(responses, resolved)
+        ui.progress('aggregate', len(responses), len(responses))
+        if store is not None:
+            record_reviews(store, args, [ args.input_file ], reviewed_pairs(responses, resolved))
+        return grade(reviews, gradebook, args, policy, open_session(args, [ args.input_file ], ui), ui, profiler, store, updates)
+
+def merge_reviews(results):
+    """Merge the reviews parsed from several exports into one list keyed
+by pid. Returns the merged reviews, the unresolved responses, the
+resolved (response, reviewee pid) pairs and a list of (pid, first file,
+second file) for students found in more than one export."""
+    merged = {}
+    sources = {}
+    pending = []
+    reviewed = []
+    conflicts = []
+    for input_file, (reviews, unresolved, resolved) in results:
+        reviewed.extend(resolved)
+        for review in reviews:
+            if review.pid in merged:
+                conflicts.append((review.pid, sources[review.pid], input_file))
+                continue
+            merged[review.pid] = review
+            sources[review.pid] = input_file
+        pending.extend(unresolved)
+    return list(merged.values()), pending, reviewed, conflicts
+
+def run_batch(args, ui=None):
+    """Parse and score several exports in parallel, one worker process
+per file, then grade the merged cohort and write the gradebook once"""
+    ui = ui or ConsoleUI()
+    try:
+        policy = load_policy(args, ui)
+    except (OSError, PolicyError):
+        return False
+    store = open_store(args)
+    with open_profiler(args, ui) as profiler:
+        # the workers' own phases and counters are not collected, their
+        # time shows up as parse
+        with profiler.phase('parse'), ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            futures = [ executor.submit(score_export, input_file, args.input_file_encoding, args.input_file_delimiter,
+                                        args.submission_points, args.aliases, args.cache_dir)
+                        for input_file in args.input_files ]
+            results = []
+            ui.progress('parse', 0, len(futures))
             try:
-                gradebook.update_item(args.name, reviews)
-            except NoSuchRecord as e:
-                stderr.write('{}\n'.format(e.message))
-                dump_file = 'reviews_abort_on_gradebook_error.csv'
-                dump_reviews(dump_file, reviews)
-                stderr.write('Grades and comments written to {}\n'.format(dump_file))
-            else:    
-                stdout.write('Grades')
-                if args.comments:
-                    stdout.write(' and comments')
-                stdout.write(" written to {}, item name '{}'\n".format(args.gradebook, args.name))
-            
-if __name__ == '__main__':
-    import sys
+                for input_file, future in zip(args.input_files, futures):
+                    results.append((input_file, future.result()))
+                    ui.progress('parse', len(results), len(futures))
+            except EncodingError as e:
+                ui.error(e.message)
+                return False
+
+        reviews, responses, reviewed, conflicts = merge_reviews(results)
+        if conflicts:
+            for pid, first, second in conflicts:
+                ui.error('{}: found in both {} and {}'.format(pid, first, second))
+            ui.error('{} students appear in more than one export, nothing written'.format(len(conflicts)))
+            return False
+
+        with profiler.phase('parse'):
+            gradebook = read_gradebook(args, store, ui)
+            updates = read_updates(args, gradebook, ui)
+        if (args.gradebook and args.name and gradebook is None) or updates is None:
+            return False
+
+        with profiler.phase('resolve'):
+            resolved = resolve_reviewees(responses, reviews, name_finder(reviews, args.aliases, ui), ui)
+        with profiler.phase('aggregate'):
+            add_responses(responses, resolved)
+        ui.progress('aggregate', len(responses), len(responses))
+        if store is not None:
+            record_reviews(store, args, args.input_files, reviewed + reviewed_pairs(responses, resolved))
+        return grade(reviews, gradebook, args, policy, open_session(args, args.input_files, ui), ui, profiler, store, updates)
+
+def argument_parser():
     import argparse
 
     parser = argparse.ArgumentParser()
-    parser.add_argument('input_file', help='input csv file exported from Scholar Tests&Quizes')
+    parser.add_argument('input_files', nargs='+', metavar='input_file', help='input csv file exported from Scholar Tests&Quizes, several files are processed in parallel')
+    parser.add_argument('--jobs', '-j', type=int, default=None, help='number of worker processes when given several input files')
     parser.add_argument('--interactive','-i', action='store_true', help='be interactive, ask for instructor contribution')
     parser.add_argument('--gradebook', '-g', help='gradebook CSV (no structure, grades only)')
     parser.add_argument('--name','-n', default="Manager's Review 2", help='gradebook item name')
     parser.add_argument('--aliases', '-a', default='aliases.txt', help='location of aliases.txt for fuzzy name matching')
     parser.add_argument('--comments', '-c', action='store_true', help='export comments to gradebook')
     parser.add_argument('--submission-points', default=3, help='number of points just for submitting a manager review')
-    parser.add_argument('--input_file_encoding', default='utf-8', help='encoding of tests&quizzes file')
-    parser.add_argument('--input_file_delimiter', default=',', help='delimiting character of tests&quizzes file')
-    parser.add_argument('--gradebook_encoding', default='utf=8', help='encoding of gradebook file')
-    parser.add_argument('--gradebook_delimiter', default=',', help='delimiting character of gradebook file')
-    
-    args = parser.parse_args()
+    parser.add_argument('--input_file_encoding', default='auto', help='encoding of tests&quizzes file, detected by default')
+    parser.add_argument('--input_file_delimiter', default='auto', help='delimiting character of tests&quizzes file, detected by default')
+    parser.add_argument('--gradebook_encoding', default='auto', help='encoding of gradebook file, detected by default')
+    parser.add_argument('--gradebook_delimiter', default='auto', help='delimiting character of gradebook file, detected by default')
+    parser.add_argument('--policy', '-p', help='JSON file of rules that set instructor points and comments, with --interactive only students matching an escalate rule are prompted for')
+    parser.add_argument('--cache-dir', default='.manager_review_cache', help='directory for cached parses of input and gradebook files (on by default, in .manager_review_cache under the current directory)')
+    parser.add_argument('--no-cache', dest='cache_dir', action='store_const', const=None, help='always parse input and gradebook files')
+    parser.add_argument('--update', '-u', action='append', metavar='ITEM=FILE',
+                        help='also set gradebook item ITEM from FILE (pid,points,comments as in reviews_backup_*.csv), may be repeated')
+    parser.add_argument('--db', metavar='FILE', help='also keep submissions, reviews, aliases and gradebook scores in this SQLite database')
+    parser.add_argument('--profile', action='store_true', help='print time spent in each phase and counts of hot operations')
+    parser.add_argument('--profile-stats', metavar='FILE', help='also write cProfile stats to FILE, implies --profile')
+    return parser
+
+if __name__ == '__main__':
+    args = argument_parser().parse_args()
 
-    run(args)
+    if len(args.input_files) > 1:
+        ok = run_batch(args)
+    else:
+        args.input_file = args.input_files[0]
+        ok = run(args)
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+
+import hmac
+import ipaddress
+import json
+import re
+import secrets
+import threading
+from sys import stderr
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import urlparse, parse_qs, unquote
+
+from app.person import normalize
+from app.session import SessionLog, session_name
+from manager_review import (argument_parser, score_export, merge_reviews, read_gradebook, name_finder, reviewee_key,
+                            load_score, render_review, dump_reviews, item_updates, read_updates)
+from scholar.gradebook import patch_gradebook_items, NoSuchRecord, NoSuchItem
+
+class ServiceError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+def summary(review):
+    return { 'pid': review.pid, 'name': review.full_name, 'section': review.section, 'group': review.group }
+
+class ReviewService:
+    """The parsed exports, gradebook, name indexes and aliases of one
+course, kept in memory between requests. Scores submitted are logged to
+the session log until they are flushed to the gradebook."""
+    def __init__(self, args):
+        self.args = args
+        results = [ (input_file, score_export(input_file, args.input_file_encoding, args.input_file_delimiter,
+                                              args.submission_points, args.aliases, args.cache_dir))
+                    for input_file in args.input_files ]
+        reviews, responses, _, conflicts = merge_reviews(results)
+        if conflicts:
+            raise ServiceError('{} students appear in more than one export'.format(len(conflicts)))
+        self.reviews = { review.pid: review for review in reviews }
+        # the review set never changes, so the name finder indexes this
+        # list once instead of on every lookup
+        self.people = list(self.reviews.values())
+        self.find_people = name_finder(reviews, args.aliases)
+        self.pending = {}
+        for response in responses:
+            self.pending.setdefault(reviewee_key(response), []).append(response)
+
+        self.gradebook = read_gradebook(args)
+        if args.gradebook and args.name and self.gradebook is None:
+            raise ServiceError('can not read gradebook {}'.format(args.gradebook))
+        self.updates = read_updates(args, self.gradebook)
+        if self.updates is None:
+            raise ServiceError('can not read the --update files')
+        for review in reviews:
+            load_score(review, self.gradebook, args)
+        self.session = SessionLog(session_name(args.input_files, args.name))
+        for pid, (points, comments) in self.session.entries.items():
+            if pid in self.reviews:
+                self.reviews[pid].instructor_points, self.reviews[pid].comments = points, comments
+        self.lock = threading.Lock()
+
+    def review(self, pid):
+        try:
+            return self.reviews[pid]
+        except KeyError:
+            raise ServiceError('{}: no such student'.format(pid), 404)
+
+    def list_reviews(self):
+        return [ dict(summary(review), points=review.points, graded=review.pid in self.session)
+                 for review in self.reviews.values() ]
+
+    def get_review(self, pid):
+        review = self.review(pid)
+        return dict(summary(review),
+                    scores=review.scores,
+                    peer_comments=review.peer_comments,
+                    peer_score=review.peer_score,
+                    reviews_received=review.reviews_received,
+                    submitted=review.submitted,
+                    submission_points=review.submission_points,
+                    instructor_points=review.instructor_points,
+                    comments=review.comments,
+                    points=review.points,
+                    graded=pid in self.session,
+                    text=render_review(review))
+
+    def resolve(self, name, section=None, group=None):
+        """People name could refer to, without prompting or adding aliases"""
+        found = self.find_people.match(self.people, normalize(name),
+                                       SimpleNamespace(section=section, group=group))
+        return [ summary(review) for review in found ]
+
+    def unresolved(self):
+        return [ { 'name': response[0].full_name, 'section': section, 'group': group, 'responses': len(response) }
+                 for (_, section, group), response in self.pending.items() ]
+
+    def assign(self, name, section, group, pid):
+        """Credit the pending responses for name to pid and remember name as
+an alias"""
+        review = self.review(pid)
+        key = (name.lower().strip(), section, group)
+        try:
+            responses = self.pending.pop(key)
+        except KeyError:
+            raise ServiceError('{}: no unresolved reviewee by that name'.format(name), 404)
+        for response in responses:
+            review.add_review(response)
+        if self.find_people.name_corrector:
+            self.find_people.name_corrector.add_alias(normalize(name), normalize(review.full_name))
+        return summary(review)
+
+    def score(self, pid, points=None, comments=None):
+        review = self.review(pid)
+        if points is not None:
+            try:
+                points = float(points)
+            except (TypeError, ValueError):
+                raise ServiceError('points must be a number, not {}'.format(json.dumps(points)))
+        if comments is not None and not isinstance(comments, str):
+            raise ServiceError('comments must be a string')
+        if points is not None:
+            review.instructor_points = points
+        if comments is not None:
+            review.comments = comments
+        self.session.record(pid, review.instructor_points, review.comments)
+        return { 'pid': pid, 'points': review.points }
+
+    def flush(self):
+        """Back up the reviews and write them to the gradebook"""
+        if self.pending:
+            raise ServiceError('{} reviewee names are unresolved'.format(len(self.pending)), 409)
+        reviews = list(self.reviews.values())
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        backup = 'reviews_backup_{}.csv'.format(timestamp)
+        dump_reviews(backup, reviews)
+        if not (self.args.gradebook and self.args.name):
+            return { 'backup': backup }
+        try:
+            patch_gradebook_items(self.args.gradebook, item_updates(self.args, reviews, self.updates),
+                                  encoding=self.args.gradebook_encoding, delimiter=self.args.gradebook_delimiter,
+                                  backup='gradebook_backup_{}.csv'.format(timestamp))
+        except (NoSuchRecord, NoSuchItem) as e:
+            raise ServiceError(e.message, 409)
+        # keep the gradebook in memory in step with the file
+        self.gradebook.update_items({ self.args.name: reviews })
+        self.session.remove()
+        return { 'backup': backup, 'gradebook': self.args.gradebook, 'written': len(reviews) }
+
+# (method, path pattern, ReviewService method), path groups, query parameters
+# and the fields of a POST body are passed as keyword arguments
+routes = [ ('GET', r'/reviews', 'list_reviews'),
+           ('GET', r'/reviews/(?P<pid>[^/]+)', 'get_review'),
+           ('POST', r'/reviews/(?P<pid>[^/]+)', 'score'),
+           ('GET', r'/resolve', 'resolve'),
+           ('GET', r'/unresolved', 'unresolved'),
+           ('POST', r'/unresolved', 'assign'),
+           ('POST', r'/flush', 'flush') ]
+
+token_header = 'X-Review-Token'
+
+def is_loopback(host):
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host.strip('[]')).is_loopback
+    except ValueError:
+        return False
+
+class Handler(BaseHTTPRequestHandler):
+    service = None
+    token = None
+
+    def check_request(self, method):
+        """Refuse requests a web page could have made: the Host and Origin
+must be local, the token printed at startup must be given and a POST body
+must be JSON, which browsers won't send across origins without asking."""
+        host = urlparse('//' + (self.headers.get('Host') or '')).hostname
+        origin = self.headers.get('Origin')
+        if not host or not is_loopback(host) or origin and not is_loopback(urlparse(origin).hostname or ''):
+            raise ServiceError('only local requests are served', 403)
+        if not hmac.compare_digest(self.headers.get(token_header) or '', self.token):
+            raise ServiceError('missing or wrong {} header'.format(token_header), 403)
+        content_type = (self.headers.get('Content-Type') or '').split(';')[0].strip().lower()
+        if method == 'POST' and content_type != 'application/json':
+            raise ServiceError('request body must be application/json', 415)
+
+    def dispatch(self, method):
+        try:
+            self.check_request(method)
+        except ServiceError as e:
+            return self.reply(e.status, { 'error': str(e) })
+        url = urlparse(self.path)
+        for route_method, pattern, name in routes:
+            m = re.fullmatch(pattern, url.path)
+            if m and route_method == method:
+                break
+        else:
+            return self.reply(404, { 'error': '{} {}: no such endpoint'.format(method, url.path) })
+        kwargs = { key: values[-1] for key, values in parse_qs(url.query).items() }
+        kwargs.update((key, unquote(value)) for key, value in m.groupdict().items())
+        try:
+            if method == 'POST':
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length) or b'{}')
+                if not isinstance(body, dict):
+                    raise ServiceError('request body must be a JSON object')
+                kwargs.update(body)
+            with self.service.lock:
+                result = getattr(self.service, name)(**kwargs)
+        except ServiceError as e:
+            return self.reply(e.status, { 'error': str(e) })
+        except (ValueError, TypeError) as e:
+            return self.reply(400, { 'error': str(e) })
+        self.reply(200, result)
+
+    def reply(self, status, result):
+        body = json.dumps(result, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+# options of manager_review.py the server has no use for
+unsupported_options = ( ('--policy', 'policy'), ('--db', 'db'), ('--profile', 'profile'),
+                        ('--profile-stats', 'profile_stats') )
+
+def serve(args):
+    unsupported = [ option for option, attr in unsupported_options if getattr(args, attr) ]
+    if unsupported:
+        raise ServiceError('{} not supported in server mode'.format(', '.join(unsupported)))
+    Handler.service = ReviewService(args)
+    Handler.token = secrets.token_urlsafe(24)
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    server.daemon_threads = True
+    server.quiet = args.quiet
+    stderr.write('Serving {} students on http://{}:{}/\n'.format(len(Handler.service.reviews), *server.server_address[:2]))
+    stderr.write('Send this token in the {} header of every request: {}\n'.format(token_header, Handler.token))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    parser = argument_parser()
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on, requests must still name a loopback host')
+    parser.add_argument('--port', type=int, default=8765, help='port to listen on')
+    parser.add_argument('--quiet', '-q', action='store_true', help="don't log requests")
+    args = parser.parse_args()
+    try:
+        serve(args)
+    except ServiceError as e:
+        stderr.write('{}\n'.format(e))
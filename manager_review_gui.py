@@ -1,14 +1,50 @@
 #!/usr/bin/env python3
 
+import queue
+import threading
+import time
 from tkinter import *
 from tkinter import filedialog
+from tkinter import simpledialog
 from tkinter.filedialog import askopenfilename
 from tkinter import constants
 from tkinter.tix import LabelEntry
 from manager_review import run
+from app.person import name_prompt
 
-encoding_options = ( 'utf-8', 'utf-16' )
-delimiter_options = { ',': ',', '<tab>': '\t' }
+encoding_options = ( 'auto', 'utf-8', 'utf-16' )
+delimiter_options = { 'auto': 'auto', ',': ',', '<tab>': '\t' }
+poll_interval = 50 # ms between checks of the worker's event queue
+
+class GuiUI:
+    """Lets run() talk to the GUI from a worker thread. Every call posts an
+event to a queue that the Tk main loop polls; ask() then blocks the worker
+until the user answers the dialog."""
+    def __init__(self):
+        self.events = queue.Queue()
+        self.shown = []
+
+    def progress(self, phase, done, total=None):
+        self.events.put(('progress', phase, done, total))
+
+    def show(self, text):
+        self.shown.append(text)
+        self.events.put(('show', text))
+
+    def error(self, text):
+        self.show(text)
+
+    def ask(self, prompt):
+        reply = queue.Queue(maxsize=1)
+        context, self.shown = '\n'.join(self.shown).strip(), []
+        self.events.put(('ask', context, prompt, reply))
+        answer = reply.get()
+        if answer is None: # dialog cancelled, treated like Ctrl+C
+            raise EOFError
+        return answer
+
+    def name_prompt(self, prompt, people, name, names=None):
+        return name_prompt(prompt, people, name, ask=self.ask, show=self.show, names=names)
 
 class Arguments:
     def __init__(self):
@@ -18,6 +54,12 @@ class Arguments:
         self.gradebook = None
         self.aliases='aliases.txt'
         self.name = "Manager's Review 2"
+        self.update = []
+        self.policy = None
+        self.cache_dir = '.manager_review_cache'
+        self.db = None
+        self.profile = False
+        self.profile_stats = None
         self.submission_points = 3
 
     @property
@@ -69,7 +111,7 @@ class FileSelect:
         self.optionmenu_encoding = OptionMenu(Frame, self.var_choice_encoding, *encoding_options).grid(row=row,column=2)
 
         self.var_choice_delimiter = StringVar()
-        self.var_choice_delimiter.set(',')
+        self.var_choice_delimiter.set('auto')
         self.optionmenu_delimiter = OptionMenu(Frame, self.var_choice_delimiter, *delimiter_options.keys()).grid(row=row, column=3)
         
         self.frame = Frame
@@ -80,10 +122,57 @@ class FileSelect:
 class Application(Frame):
     def run_with_args(self):
         self.args.name = self.item_name.get()
+        self.args.profile = self.profile.get()
         self.args.submission_points = float(self.submission_points.get())
         (self.args.input_file, self.args.input_file_encoding, self.args.input_file_delimiter) = self.fileselect_input.get()
         (self.args.gradebook, self.args.gradebook_encoding, self.args.gradebook_delimiter) = self.fileselect_gradebook.get()
-        return run(self.args)
+        self.run["state"] = DISABLED
+        self.ui = GuiUI()
+        self.phase = None
+        self.worker = threading.Thread(target=self.work, daemon=True)
+        self.worker.start()
+        self.after(poll_interval, self.poll)
+
+    def work(self):
+        """Body of the worker thread, never touches Tk"""
+        try:
+            ok = run(self.args, self.ui)
+        except Exception as e:
+            self.ui.events.put(('error', e))
+        else:
+            # run() has already shown why it failed in the log
+            self.ui.events.put(('done',) if ok else ('error', 'see the log for details'))
+
+    def poll(self):
+        """Handle the worker's pending events on the Tk thread"""
+        while True:
+            try:
+                event = self.ui.events.get_nowait()
+            except queue.Empty:
+                break
+            kind, *details = event
+            if kind == 'progress':
+                self.show_progress(*details)
+            elif kind == 'show':
+                self.log.insert(END, details[0] + '\n')
+                self.log.see(END)
+            elif kind == 'ask':
+                context, prompt, reply = details
+                reply.put(simpledialog.askstring(self.master.title(), context + '\n\n' + prompt, parent=self))
+            else:
+                self.status.set('Finished' if kind == 'done' else 'Failed: {}'.format(details[0]))
+                self.run["state"] = NORMAL
+                return
+        self.after(poll_interval, self.poll)
+
+    def show_progress(self, phase, done, total):
+        if phase != self.phase:
+            self.phase, self.phase_start = phase, time.monotonic()
+        elapsed = time.monotonic() - self.phase_start
+        status = '{}: {}'.format(phase, done) if total is None else '{}: {}/{}'.format(phase, done, total)
+        if done and elapsed > 0:
+            status += ' ({:.0f}/s)'.format(done / elapsed)
+        self.status.set(status)
         
     def createWidgets(self):
 
@@ -101,6 +190,8 @@ class Application(Frame):
         self.label_submission_points = Label(self, text="Points for submission").grid(row=4, sticky=W)
         self.entry_submission_points = Entry(self, textvariable=self.submission_points).grid(row=4, column=1)
         
+        Checkbutton(self, text="Profile", variable=self.profile).grid(row=4, column=2, sticky=W)
+
         self.run = Button(self)
         self.run["text"] = "Go",
         self.run["command"] = self.run_with_args
@@ -112,6 +203,11 @@ class Application(Frame):
         self.QUIT["command"] =  self.quit
 
         self.QUIT.grid(row=5, column=2)
+
+        self.status = StringVar()
+        Label(self, textvariable=self.status).grid(row=6, columnspan=4, sticky=W)
+        self.log = Text(self, height=20, width=80)
+        self.log.grid(row=7, columnspan=4)
         
     def __init__(self, master=None):
         Frame.__init__(self, master, borderwidth=5)
@@ -121,6 +217,8 @@ class Application(Frame):
         self.item_name.set(self.args.name)
         self.submission_points = StringVar()
         self.submission_points.set(self.args.submission_points)
+        self.profile = BooleanVar()
+        self.profile.set(self.args.profile)
         self.grid()
         self.createWidgets()
         self.input_label = None
@@ -0,0 +1,132 @@
+import codecs
+import csv
+import io
+import mmap
+import os
+
+sniff_size = 64 * 1024      # bytes read to detect the encoding and delimiter
+chunk_size = 1 << 20        # bytes decoded at a time
+mmap_threshold = 64 << 20   # files at least this large are read through mmap
+delimiters = ( '\t', ',', ';' )
+
+# UTF-32 first, its little endian BOM starts with UTF-16's
+boms = ( (codecs.BOM_UTF32_LE, 'utf-32'), (codecs.BOM_UTF32_BE, 'utf-32'), (codecs.BOM_UTF8, 'utf-8-sig'),
+         (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16') )
+
+class EncodingError(ValueError):
+    def __init__(self, fname, message):
+        # both arguments are kept so the error pickles back from a worker
+        super().__init__(fname, message)
+        self.fname = fname
+        self.message = '{}: {}'.format(fname, message)
+
+    def __str__(self):
+        return self.message
+
+def is_wide(encoding):
+    return codecs.lookup(encoding).name.startswith(('utf-16', 'utf-32'))
+
+def sniff_encoding(head):
+    """Encoding given by a byte order mark or a pattern of NUL bytes at the
+start of a file, None if there is neither"""
+    for bom, encoding in boms:
+        if head.startswith(bom):
+            return encoding
+    sample = head[:1024]
+    if len(sample) >= 2:
+        if sample[1::2].count(0) > len(sample) // 4:
+            return 'utf-16-le'
+        if sample[0::2].count(0) > len(sample) // 4:
+            return 'utf-16-be'
+    return None
+
+def sniff_delimiter(text):
+    """Delimiter of the header line of text. Scholar's Tests & Quizzes
+headers contain commas, so a tab anywhere in the header wins."""
+    header = text.split('\n', 1)[0]
+    if '\t' in header:
+        return '\t'
+    return max(delimiters[1:], key=header.count)
+
+class CSVInput:
+    """A delimited text file decoded in large chunks.
+
+encoding and delimiter may be 'auto' to detect them from the start of the
+file. An explicit encoding is checked against the start of the file so a
+wrong one fails before the file is read. A guessed encoding only holds for
+the start of the file, so write_encoding is UTF-8 then."""
+    def __init__(self, fname, encoding='auto', delimiter='auto', use_mmap=None):
+        self.fname = fname
+        self.use_mmap = use_mmap
+        with open(fname, 'rb') as f:
+            head = f.read(sniff_size)
+        sniffed = sniff_encoding(head)
+        self.guessed = encoding == 'auto' and sniffed is None
+        if encoding == 'auto':
+            encoding = sniffed or self.guess_encoding(head)
+        elif sniffed and is_wide(sniffed) != is_wide(encoding):
+            raise EncodingError(fname, 'not {}, looks like {}'.format(encoding, sniffed))
+        elif sniffed is None and is_wide(encoding):
+            raise EncodingError(fname, 'not {}, there is no byte order mark'.format(encoding))
+        elif sniffed == 'utf-8-sig' and codecs.lookup(encoding).name == 'utf-8':
+            encoding = sniffed
+        self.encoding = encoding
+        try:
+            text = codecs.getincrementaldecoder(encoding)().decode(head)
+        except UnicodeDecodeError as e:
+            raise EncodingError(fname, 'not {}: {}'.format(encoding, e.reason))
+        self.delimiter = sniff_delimiter(text) if delimiter == 'auto' else delimiter
+
+    @staticmethod
+    def guess_encoding(head):
+        try:
+            codecs.getincrementaldecoder('utf-8')().decode(head)
+        except UnicodeDecodeError:
+            return 'cp1252'
+        return 'utf-8'
+
+    @property
+    def write_encoding(self):
+        """Encoding to write the file back with"""
+        return 'utf-8' if self.guessed else self.encoding
+
+    def chunks(self):
+        with open(self.fname, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            use_mmap = self.use_mmap if self.use_mmap is not None else size >= mmap_threshold
+            if use_mmap and size > 0:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                    for start in range(0, size, chunk_size):
+                        yield m[start:start + chunk_size]
+            else:
+                yield from iter(lambda: f.read(chunk_size), b'')
+
+    def lines(self, newline=None):
+        """Yield the decoded lines of the file, newline as for open()"""
+        decoder = codecs.getincrementaldecoder(self.encoding)()
+        pending = ''
+        offset = 0
+        for chunk in self.chunks():
+            text = pending + self.decode(decoder, chunk, offset)
+            offset += len(chunk)
+            # cut after the last \n so a \r\n is never split between chunks
+            end = text.rfind('\n') + 1
+            pending = text[end:]
+            if end:
+                yield from io.StringIO(text[:end], newline=newline)
+        pending += self.decode(decoder, b'', offset, final=True)
+        if pending:
+            yield from io.StringIO(pending, newline=newline)
+
+    def decode(self, decoder, data, offset, final=False):
+        """decoder.decode(data) where data starts offset bytes into the
+file, a decoding error gives the offset of the bad byte"""
+        buffered = len(decoder.getstate()[0])
+        try:
+            return decoder.decode(data, final)
+        except UnicodeDecodeError as e:
+            raise EncodingError(self.fname, 'not {} at byte {}: {}'.format(self.encoding, offset - buffered + e.start,
+                                                                          e.reason))
+
+    def reader(self, newline=None):
+        return csv.reader(self.lines(newline), delimiter=self.delimiter)
@@ -1,13 +1,24 @@
 import csv
+import os
 import re
+import shutil
+from collections.abc import MutableMapping
 
-from util import label_to_attr, num_or_none
+from util import label_to_attr, num_or_none, count
+from .csvinput import CSVInput
 
 base_headers = ['Student Id', 'Student Name', 'Section']
 tail_headers = ['Letter Grade', 'Total Points', 'Calculated Grade']
 gradebook_regex = re.compile(r'([^()]+) ((?:\([-0R]\)\s)+)?\[([0-9]+)\]$')
 gradebook_comment_regex = re.compile(r'Comment\s+:\s+([^()]+)$')
 
+# record attributes answered from Gradebook's record indexes
+indexed_attrs = { 'student_id': 'student_id', 'pid': 'student_id',
+                  'student_name': 'student_name', 'name': 'student_name', 'full_name': 'student_name' }
+
+def normalize_name(name):
+    return ' '.join(name.lower().split())
+
 def comment_key(item_name):
     return "Comment : " + item_name
 
@@ -20,7 +31,7 @@ class GradebookError(Exception):
     
 class NoSuchItem(GradebookError):
     def __init__(self, item_name):
-        self.item_name
+        self.item_name = item_name
         super().__init__('{}: no such grade item'.format(self.item_name))
 
     def __str__(self):
@@ -44,18 +55,72 @@ class GradebookItem:
         return "{:0.1f}".format(self._points + self.adjust)
     
 class GradebookScore:
+    __slots__ = ('points', 'comments')
+
     def __init__(self, points, comments):
         self.points = num_or_none(float,points)
         self.comments = comments
-        
+
+class RowLayout:
+    """Column positions shared by every row read from one gradebook"""
+    __slots__ = ('columns', 'items')
+
+    def __init__(self, fieldnames):
+        index = { label: i for i, label in enumerate(fieldnames) }
+        self.columns = { label_to_attr(label): index[label] for label in base_headers + tail_headers if label in index }
+        self.items = {}
+        for i, fieldname in enumerate(fieldnames):
+            if fieldname not in base_headers + tail_headers:
+                m = gradebook_regex.match(fieldname)
+                if m:
+                    self.items[m.group(1)] = (i, index.get(comment_key(m.group(1))))
+
+class RowItems(MutableMapping):
+    """Item scores of a row by item name, decoded on first access"""
+    __slots__ = ('row',)
+
+    def __init__(self, row):
+        self.row = row
+
+    def __getitem__(self, item_name):
+        return self.row.score(item_name)
+
+    def __setitem__(self, item_name, score):
+        self.row.set_score(item_name, score)
+
+    def __delitem__(self, item_name):
+        raise TypeError('gradebook items can not be removed from a row')
+
+    def __iter__(self):
+        return iter(self.row.layout.items)
+
+    def __len__(self):
+        return len(self.row.layout.items)
+
+def column_property(attr):
+    return property(lambda self: self.cell(self.layout.columns.get(attr)))
+
 class GradebookRow:
-    def __init__(self, pid, name, section):
-        self.student_id = pid
-        self.student_name = name
-        self.section = section
-        self.letter_grade = ''
-        self.total_points = ''
-        self.calculated_grade = ''
+    """A gradebook record kept as its raw cells, item scores are decoded
+into GradebookScore objects only when first accessed"""
+    __slots__ = ('cells', 'layout', '_scores')
+
+    def __init__(self, cells, layout):
+        self.cells = tuple(cells)
+        self.layout = layout
+        self._scores = None
+
+    student_id = column_property('student_id')
+    student_name = column_property('student_name')
+    section = column_property('section')
+    letter_grade = column_property('letter_grade')
+    total_points = column_property('total_points')
+    calculated_grade = column_property('calculated_grade')
+
+    def cell(self, index):
+        if index is None or index >= len(self.cells):
+            return ''
+        return self.cells[index]
 
     @property
     def pid(self):
@@ -69,6 +134,38 @@ class GradebookRow:
     def name(self):
         return self.student_name
 
+    @property
+    def items(self):
+        return RowItems(self)
+
+    def score(self, item_name):
+        if self._scores is None:
+            self._scores = {}
+        try:
+            return self._scores[item_name]
+        except KeyError:
+            score_column, comment_column = self.layout.items[item_name]
+            score = GradebookScore(self.cell(score_column), self.cell(comment_column))
+            self._scores[item_name] = score
+            return score
+
+    def set_score(self, item_name, score):
+        if self._scores is None:
+            self._scores = {}
+        self._scores[item_name] = score
+
+    def points_cell(self, item_name):
+        """Value to write for item_name's points: the raw cell unless the
+score has been decoded"""
+        if self._scores is not None and item_name in self._scores:
+            return self._scores[item_name].points
+        return self.cell(self.layout.items[item_name][0])
+
+    def comments_cell(self, item_name):
+        if self._scores is not None and item_name in self._scores:
+            return self._scores[item_name].comments
+        return self.cell(self.layout.items[item_name][1])
+
     def score_for(self, item_name):
         return self.items[item_name]
     
@@ -143,25 +240,24 @@ def gradebook_items_from_fieldnames(fieldnames):
     return gbitems
                 
 
-def items_from_row(row, items):
-    def score(item):
-        return row[item.label]
-    def comment(item):
-        try:
-            return row[item.comment_label]
-        except KeyError:
-            return ""
-    return { item.name: GradebookScore(score(item), comment(item)) for item in items }
-        
-def record_from_row(row, items):
-    person = GradebookRow(row['Student Id'], row['Student Name'], row['Section'])
-    for label in tail_headers:
-        setattr(person, label_to_attr(label), row[label])
-    person.items = items_from_row(row, items)
-    return person
+def record_from_row(row, layout):
+    return GradebookRow(row, layout)
+
+def attr_accessor(label):
+    attr = label_to_attr(label)
+    def accessor(record):
+        return getattr(record, attr)
+    return accessor
+
+def points_accessor(item_name):
+    def accessor(record):
+        return record.points_cell(item_name)
+    return accessor
 
-def object_to_dict(obj, fieldnames):
-    return { key: obj[key] for key in fieldnames }
+def comments_accessor(item_name):
+    def accessor(record):
+        return record.comments_cell(item_name)
+    return accessor
 
 class Gradebook:    
     def __init__(self, csvfile, mode, **kwargs):
@@ -171,19 +267,48 @@ class Gradebook:
         self.csvfile = csvfile
         self.read(self.csvfile, **kwargs)
 
+    @property
+    def items(self):
+        return self._items
+
+    @items.setter
+    def items(self, items):
+        self._items = list(items)
+        self._item_index = { item.name: item for item in self._items }
+
+    @property
+    def records(self):
+        return self._records
+
+    @records.setter
+    def records(self, records):
+        self._records = []
+        self._record_index = { 'student_id': {}, 'student_name': {} }
+        self._section_index = {}
+        for record in records:
+            self.add_record(record)
+
+    def add_record(self, record):
+        self._records.append(record)
+        self._record_index['student_id'].setdefault(record.student_id, record)
+        self._record_index['student_name'].setdefault(normalize_name(record.student_name), record)
+        self._section_index.setdefault(record.section, []).append(record)
+
     def read(self, filename, **kwargs):
-        with open(filename, 'r', encoding=self.encoding) as f:
-            reader = csv.DictReader(f, delimiter=self.delimiter)
-            #self.has_comments = any([ gradebook_comment_regex.match(fieldname) for fieldname in reader.fieldnames ])
-            self.items = gradebook_items_from_fieldnames(reader.fieldnames)
-            self.records = [ record_from_row(row, self.items) for row in reader ]
+        source = CSVInput(filename, self.encoding, self.delimiter)
+        # written back with the encoding and delimiter actually found
+        self.encoding, self.delimiter = source.write_encoding, source.delimiter
+        reader = source.reader()
+        fieldnames = next(reader)
+        self.items = gradebook_items_from_fieldnames(fieldnames)
+        layout = RowLayout(fieldnames)
+        self.records = [ record_from_row(row, layout) for row in reader if row ]
 
     def get_item(self, item_name):
         try:
-            item = [ item for item in self.items if item.name == item_name ][0]
-        except IndexError:
-            raise NoSuchItem(item)
-        return item
+            return self._item_index[item_name]
+        except KeyError:
+            raise NoSuchItem(item_name)
 
     def has_item(self, item_name):
         try:
@@ -194,38 +319,66 @@ class Gradebook:
             return True
 
     def record_for(self, attr_name, rvalue):
+        """First record whose attr_name equals rvalue. Lookups by student id
+or (case and whitespace insensitive) name are answered from an index."""
+        count('record_lookups')
+        attr_name = indexed_attrs.get(attr_name, attr_name)
+        if attr_name in self._record_index:
+            key = normalize_name(rvalue) if attr_name == 'student_name' else rvalue
+            try:
+                return self._record_index[attr_name][key]
+            except (KeyError, TypeError):
+                raise NoSuchRecord(attr_name, rvalue)
         try:
             record = [ record for record in self.records if getattr(record, attr_name, None) == rvalue ][0]
         except IndexError:
             raise NoSuchRecord(attr_name, rvalue)
         return record
 
+    def records_in_section(self, section):
+        return self._section_index.get(section, [])
+
     def records_for(self, item_name):
         item = self.get_item(item_name)
-        records = [ record.items[item_name] for record in self.records ]
+        return [ record.items[item_name] for record in self.records ]
 
     def update_item(self, item_name, scores):
-        item = self.get_item(item_name)
-        for s in scores:
-            record = self.record_for('student_id', s.pid)
-            r = GradebookScore(s.points, s.comments)
-            record.items[item_name] = r
+        self.update_items({ item_name: scores })
+
+    def update_items(self, updates):
+        """Update several items at once from a dict of item name to scores,
+each score having pid, points and comments. Every item and record is
+looked up before any record is changed."""
+        changes = []
+        for item_name, scores in updates.items():
+            self.get_item(item_name)
+            for s in scores:
+                changes.append((self.record_for('student_id', s.pid), item_name, s))
+        for record, item_name, s in changes:
+            record.items[item_name] = GradebookScore(s.points, s.comments)
+
+    def columns(self):
+        """List of (header, accessor) for each column written, where
+accessor(record) returns the cell value"""
+        columns = [ (label, attr_accessor(label)) for label in base_headers ]
+        for item in self.items:
+            columns.append((item.label, points_accessor(item.name)))
+            columns.append((item.comment_label, comments_accessor(item.name)))
+        columns += [ (label, attr_accessor(label)) for label in tail_headers ]
+        return columns
 
     @property
     def fieldnames(self):
-        fields = base_headers
-        for item in self.items:
-            fields.append(item.label)
-            fields.append(item.comment_label)
-        fields = fields + tail_headers
-        return fields
+        return [ label for label, _ in self.columns() ]
 
     def write(self, filename):
+        columns = self.columns()
+        accessors = [ accessor for _, accessor in columns ]
         with open(filename, 'w', newline='', encoding=self.encoding) as f:
-            writer = csv.DictWriter(f, fieldnames=self.fieldnames, delimiter=self.delimiter)
-            writer.writeheader()
-            for record in self.records:
-                writer.writerow(object_to_dict(record, self.fieldnames))
+            writer = csv.writer(f, delimiter=self.delimiter)
+            writer.writerow([ label for label, _ in columns ])
+            count('cells_written', len(columns) * (len(self.records) + 1))
+            writer.writerows(tuple([ accessor(record) for accessor in accessors ]) for record in self.records)
 
     def __enter__(self):
         return self
@@ -240,6 +393,96 @@ class Gradebook:
 def open_gradebook(fname, mode, **kwargs):
     return Gradebook(fname, mode, **kwargs)
 
+def item_columns(fieldnames, item_name):
+    """Indexes of the score and comment columns for item_name, the
+comment index is None if the gradebook has no comment column for it"""
+    score_column = None
+    for i, fieldname in enumerate(fieldnames):
+        m = gradebook_regex.match(fieldname)
+        if m and m.group(1) == item_name and fieldname not in base_headers + tail_headers:
+            score_column = i
+            break
+    if score_column is None:
+        raise NoSuchItem(item_name)
+    try:
+        comment_column = fieldnames.index(comment_key(item_name))
+    except ValueError:
+        comment_column = None
+    return score_column, comment_column
+
+def patch_gradebook(fname, item_name, scores, **kwargs):
+    """Rewrite one item's score and comment columns of a gradebook CSV,
+see patch_gradebook_items"""
+    patch_gradebook_items(fname, { item_name: scores }, **kwargs)
+
+def patch_gradebook_items(fname, updates, **kwargs):
+    """Rewrite the score and comment columns of several items of a
+gradebook CSV in a single pass, streaming it row by row.
+
+updates maps item name to a dict of pid to (points, comments); every
+other cell is copied through unchanged. A comment column is added after
+an item's score column if the gradebook has none. Every item is checked
+before anything is written, and the gradebook is replaced only once
+every pid has been found. If backup is given the original gradebook is
+copied there first."""
+    encoding = kwargs.pop('encoding', 'utf8')
+    delimiter = kwargs.pop('delimiter', ',')
+    output = kwargs.pop('output', fname)
+    backup = kwargs.pop('backup', None)
+    tmp_name = output + '.tmp'
+    remaining = { (item_name, pid) for item_name, scores in updates.items() for pid in scores }
+    source = CSVInput(fname, encoding, delimiter)
+    encoding, delimiter = source.write_encoding, source.delimiter
+    reader = source.reader(newline='')
+    fieldnames = next(reader)
+    pid_column = fieldnames.index(base_headers[0])
+    columns = { item_name: item_columns(fieldnames, item_name) for item_name in updates }
+    added = { score_column: item_name for item_name, (score_column, comment_column) in columns.items()
+              if comment_column is None }
+
+    def expand(row, comments):
+        """Insert the added comment columns into row"""
+        if not added:
+            return row
+        expanded = []
+        for i, cell in enumerate(row):
+            expanded.append(cell)
+            if i in added:
+                expanded.append(comments.get(added[i], ''))
+        return expanded
+
+    try:
+        with open(tmp_name, 'w', newline='', encoding=encoding) as out:
+            writer = csv.writer(out, delimiter=delimiter)
+            writer.writerow(expand(fieldnames, { item_name: comment_key(item_name) for item_name in added.values() }))
+            for row in reader:
+                pid = row[pid_column] if len(row) > pid_column else None
+                comments = {}
+                for item_name, scores in updates.items():
+                    if pid not in scores:
+                        continue
+                    points, item_comments = scores[pid]
+                    score_column, comment_column = columns[item_name]
+                    if len(row) <= max(score_column, comment_column or 0):
+                        row += [''] * (max(score_column, comment_column or 0) + 1 - len(row))
+                    row[score_column] = num_or_none(float, points) if points is not None else None
+                    if comment_column is None:
+                        comments[item_name] = item_comments
+                    else:
+                        row[comment_column] = item_comments
+                    remaining.discard((item_name, pid))
+                row = expand(row, comments)
+                count('cells_written', len(row))
+                writer.writerow(row)
+        if remaining:
+            raise NoSuchRecord('student_id', min(remaining)[1])
+        if backup is not None:
+            shutil.copyfile(fname, backup)
+        os.replace(tmp_name, output)
+    finally:
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+
 if __name__ == '__main__':
     from sys import argv
     
@@ -1,8 +1,7 @@
-import csv
-from operator import itemgetter, attrgetter
-from itertools import groupby
 import re
 
+from util import num_or_none
+from .csvinput import CSVInput
 from .person import Person
 
 response_filter_regex = re.compile(r'Part ([1-9]+), Question ([1-9]+), (.*)')
@@ -26,17 +25,13 @@ def response_attribute(r):
     return 'comments'
 
 class QuestionResponse:
-    def __init__(self, part, question, response, **kwargs):
+    __slots__ = ('part', 'question', 'response', 'comments')
+
+    def __init__(self, part, question, response=None, comments=None):
         self.part = part
         self.question = question
-        self.response = None
-        self.comments = None
-        for k,r in response.items():
-            setattr(self, response_attribute(k), r)
-
-        response_filter = kwargs.pop('response_filter', None)
-        if response_filter:
-            self.response = response_filter(self.qid)(self.response)
+        self.response = response
+        self.comments = comments
 
     @property
     def result(self):
@@ -49,13 +44,59 @@ class QuestionResponse:
     def __repr__(self):
         return '<QuestionResponse {} {}>'.format((self.part, self.question), (self.response, self.comments))
 
+class ColumnPlan:
+    """Column layout of a Tests & Quizzes export, compiled once from its
+header so rows can be decoded by index"""
+    def __init__(self, fieldnames, **kwargs):
+        response_filter = kwargs.pop('response_filter', None)
+        index = { name: i for i, name in enumerate(fieldnames) }
+        self.fieldnames = fieldnames
+        self.width = len(fieldnames)
+        self.firstname = index[fields['firstname']]
+        self.lastname = index[fields['lastname']]
+        self.pid = index[fields['pid']]
+        self.order = index[fields['order']]
+
+        columns = {}
+        for i, name in enumerate(fieldnames):
+            qid = question_id(name)
+            if qid:
+                columns.setdefault(qid, {})[response_attribute(name)] = i
+        # (part, question, response column, comments column, decoder)
+        self.questions = [ (qid[0], qid[1], columns[qid].get('response'), columns[qid].get('comments'),
+                            response_filter(qid) if response_filter else None)
+                           for qid in sorted(columns) ]
+
+    def decode(self, row):
+        """Return the responses in row as a list of QuestionResponse"""
+        if len(row) < self.width:
+            row = row + [None] * (self.width - len(row))
+        responses = []
+        for part, question, response, comments, decoder in self.questions:
+            value = row[response] if response is not None else None
+            if decoder:
+                value = decoder(value)
+            responses.append(QuestionResponse(part, question, value,
+                                              row[comments] if comments is not None else None))
+        return responses
+
 class QuizSubmission(Person):
-    def __init__(self, row, **kwargs):
-        super().__init__(row[fields['firstname']], row[fields['lastname']], row[fields['pid']])
-        self.submission_order = row[fields['order']]
-        self._responses = [ QuestionResponse(k[0], k[1], { k: row[k] for k in g }, **kwargs)
-                           for k, g in groupby(sorted([ k for k in row.keys() if question_id(k) ], key=question_id), question_id) ]
+    def __init__(self, row, plan):
+        super().__init__(row[plan.firstname], row[plan.lastname], row[plan.pid])
+        self.submission_order = row[plan.order]
+        self.attempt = num_or_none(int, self.submission_order)
+        self._responses = plan.decode(row)
+        self._by_qid = { r.qid: r for r in self._responses }
+        parts = {}
+        for r in self._responses:
+            parts.setdefault(r.part, []).append(r)
+        self._by_part = { part: tuple(rs) for part, rs in parts.items() }
             
+    @property
+    def attempt_key(self):
+        """Numeric submission order, unsubmitted attempts sort first"""
+        return -1 if self.attempt is None else self.attempt
+
     def response_map(self, fn):
         return { fn(k): v for k,v in self._responses }
 
@@ -67,36 +108,76 @@ class QuizSubmission(Person):
 particular part and question number"""
         
         if question:
-            return [ r for r in self._responses if r.qid == (part,question) ][0]
-        return [ r for r in self._responses if r.part == part ]
+            try:
+                return self._by_qid[(part,question)]
+            except KeyError:
+                raise IndexError((part,question))
+        return self._by_part.get(part, ())
 
     def __repr__(self):
         return "<QuizSubmisson {}: {} questions>".format(super().__repr__(), len(self._responses))
     
+def latest_attempts(submissions):
+    """Reduce an iterable of submissions to a dict of the newest attempt
+per pid"""
+    latest = {}
+    for submission in submissions:
+        current = latest.get(submission.pid)
+        if current is None or submission.attempt_key > current.attempt_key:
+            latest[submission.pid] = submission
+    return latest
+
 class QuizSubmissions:
+    """Submissions from a Tests & Quizzes export.
+
+With stream=True rows are reduced to the newest attempt per pid as they
+are read and the full set of attempts is never kept in memory."""
     def __init__(self, filename, **kwargs):
-        self.rows = []
-        encoding = kwargs.pop('encoding', 'utf8')
-        delimiter = kwargs.pop('delimiter', ',')
-        with open(filename, 'r', encoding=encoding) as f:
-            reader = csv.DictReader(f, delimiter=delimiter)
-            self.fieldnames = reader.fieldnames
-            self.responses = [ QuizSubmission(row, **kwargs) for row in reader ]
+        self.filename = filename
+        self.encoding = kwargs.pop('encoding', 'utf8')
+        self.delimiter = kwargs.pop('delimiter', ',')
+        stream = kwargs.pop('stream', False)
+        self.plan_kwargs = kwargs
+        self.fieldnames = None
+        self.plan = None
+        self._latest = None
+        self.responses = None
+        if stream:
+            self._latest = latest_attempts(self)
+        else:
+            self.responses = list(self)
+
+    def __iter__(self):
+        """Yield each submission in the export, one row at a time"""
+        reader = CSVInput(self.filename, self.encoding, self.delimiter).reader()
+        self.fieldnames = next(reader)
+        self.plan = ColumnPlan(self.fieldnames, **self.plan_kwargs)
+        for row in reader:
+            if row:
+                yield QuizSubmission(row, self.plan)
+
+    def __getstate__(self):
+        # the plan holds decoder functions, it is rebuilt when iterating
+        state = self.__dict__.copy()
+        state['plan'] = None
+        state['plan_kwargs'] = {}
+        return state
+
+    def latest_by_pid(self):
+        if self._latest is not None:
+            return self._latest
+        return latest_attempts(self.responses)
 
     @property
     def latest(self):
-        return [ max(g, key=attrgetter('submission_order'))
-               for k, g in groupby(sorted(self.responses, key=attrgetter('full_name')), attrgetter('full_name')) ]
+        return list(self.latest_by_pid().values())
 
     def latest_for(self, pid):
-        try:
-            return sorted([ row for row in self.rows if row[pid_field] == pid ], key=itemgetter('Order of Submission (1=first)'))[-1]
-        except IndexError:
-            return None
+        return self.latest_by_pid().get(pid)
 
     @property    
     def keys(self):
-        return [ row[pid_field] for row in self.results ]
+        return list(self.latest_by_pid().keys())
 
         
 if __name__ == '__main__':
@@ -0,0 +1,34 @@
+import pytest
+
+import scholar.csvinput
+from scholar.csvinput import CSVInput, EncodingError
+
+text = 'Last Name,First Name\r\nZoë,Ångström\r\n"Łukasz, Jr.",日本\r\nO\'Brien,😀\r\n'
+
+@pytest.mark.parametrize('encoding', [ 'utf-8', 'utf-8-sig', 'utf-16', 'utf-16-le' ])
+@pytest.mark.parametrize('use_mmap', [ False, True ])
+def test_lines_across_chunk_boundaries(tmp_path, monkeypatch, encoding, use_mmap):
+    fname = tmp_path / 'input.csv'
+    fname.write_bytes(text.encode(encoding))
+    for chunk_size in range(1, 9):
+        monkeypatch.setattr(scholar.csvinput, 'chunk_size', chunk_size)
+        source = CSVInput(str(fname), encoding, use_mmap=use_mmap)
+        assert list(source.lines(newline='')) == text.splitlines(keepends=True)
+        assert list(source.reader()) == [ ['Last Name', 'First Name'], ['Zoë', 'Ångström'],
+                                          ['Łukasz, Jr.', '日本'], ["O'Brien", '😀'] ]
+
+def test_bad_byte_after_sample(tmp_path, monkeypatch):
+    monkeypatch.setattr(scholar.csvinput, 'sniff_size', 16)
+    monkeypatch.setattr(scholar.csvinput, 'chunk_size', 5)
+    data = text.encode('utf-8')
+    fname = tmp_path / 'input.csv'
+    fname.write_bytes(data[:40] + b'\xff' + data[40:])
+    with pytest.raises(EncodingError, match='at byte 40'):
+        list(CSVInput(str(fname), 'utf-8').lines())
+
+def test_guessed_encoding_written_as_utf8(tmp_path):
+    fname = tmp_path / 'input.csv'
+    fname.write_bytes('Name\r\nZoë\r\n'.encode('cp1252'))
+    source = CSVInput(str(fname))
+    assert (source.encoding, source.write_encoding) == ('cp1252', 'utf-8')
+    assert CSVInput(str(fname), 'cp1252').write_encoding == 'cp1252'
@@ -0,0 +1,34 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app import synthetic
+from scholar.gradebook import Gradebook, NoSuchRecord, patch_gradebook_items
+
+@pytest.mark.parametrize('encoding, delimiter', [ ('utf-8', ','), ('utf-16', '\t') ])
+def test_patch_matches_write(tmp_path, encoding, delimiter):
+    cohort = synthetic.make_cohort(60)
+    source = str(tmp_path / 'gradebook.csv')
+    synthetic.write_gradebook(source, cohort, items=5, encoding=encoding, delimiter=delimiter)
+    scores = { student.pid: ('{}.5'.format(i % 10), 'Comment on {}'.format(student.first_name))
+               for i, student in enumerate(cohort) }
+
+    gradebook = Gradebook(source, 'r', encoding='auto', delimiter='auto')
+    gradebook.update_items({ synthetic.review_item: [ SimpleNamespace(pid=pid, points=points, comments=comments)
+                                                      for pid, (points, comments) in scores.items() ] })
+    written = tmp_path / 'written.csv'
+    gradebook.write(str(written))
+
+    patched = tmp_path / 'patched.csv'
+    patch_gradebook_items(source, { synthetic.review_item: scores }, encoding='auto', delimiter='auto',
+                          output=str(patched))
+    assert patched.read_bytes() == written.read_bytes()
+
+def test_patch_failure_leaves_no_temporary(tmp_path):
+    source = tmp_path / 'gradebook.csv'
+    synthetic.write_gradebook(str(source), synthetic.make_cohort(10), items=2)
+    original = source.read_bytes()
+    with pytest.raises(NoSuchRecord):
+        patch_gradebook_items(str(source), { synthetic.review_item: { 'nobody': ('1', '') } })
+    assert source.read_bytes() == original
+    assert [ path.name for path in tmp_path.iterdir() ] == [ 'gradebook.csv' ]
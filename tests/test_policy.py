@@ -0,0 +1,71 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.policy import matches, Rule, Policy, PolicyError
+
+@pytest.mark.parametrize('condition, value, expected', [
+    ([2, 5], 2, True), ([2, 5], 5, True), ([2, 5], 1.5, False), ([2, 5], 5.5, False),
+    ([None, 6], -100, True), ([None, 6], 7, False), ([6, None], 100, True), ([6, None], 5, False),
+    ([None, None], 0, True), (False, False, True), (False, True, False), (3, 3.0, True) ])
+def test_matches(condition, value, expected):
+    assert matches(condition, value) == expected
+
+@pytest.mark.parametrize('rule', [
+    { 'when': [ 'submitted' ] },
+    { 'when': { 'grade': 1 } },
+    { 'when': { 'peer_subtotal': [ 1, 2, 3 ] } },
+    { 'when': { 'peer_subtotal': [ '1', 2 ] } },
+    { 'when': { 'peer_subtotal': [ True, 2 ] } },
+    { 'points': 'grade' },
+    { 'points': [ 1 ] },
+    { 'points': True },
+    { 'comments': 5 },
+    { 'comments': 'Scored {grade}' },
+    { 'comments': 'Scored {}' },
+    { 'comments': 'Scored {0}' },
+    { 'comments': 'Scored {peer_subtotal' },
+    { 'comments': 'Scored }' } ])
+def test_rule_validation(rule):
+    with pytest.raises(PolicyError):
+        Policy([ rule ])
+
+def test_valid_rule():
+    rule = Rule(when={ 'peer_subtotal': [ None, 6.5 ], 'submitted': True }, points='team_median',
+                comments='{peer_subtotal:.1f} against {team_median} ({reviews} reviews)')
+    assert rule.points == 'team_median' and not rule.escalate
+
+def review(**fields):
+    defaults = dict(peer_score=8, submitted=True, reviews_received=3, section='1', group='A',
+                    instructor_points=None, comments='')
+    defaults.update(fields)
+    return SimpleNamespace(**defaults)
+
+policy = Policy([ { 'when': { 'submitted': False }, 'points': 0, 'comments': 'No review submitted' },
+                  { 'when': { 'team_deviation': [ None, -2 ] }, 'escalate': True },
+                  { 'when': { 'peer_subtotal': [ 7, None ] }, 'points': 'peer_subtotal',
+                    'comments': '{peer_subtotal} of a team median {team_median}' } ])
+
+def test_apply_first_matching_rule():
+    late = review(submitted=False, peer_score=9)
+    assert policy.apply(late, { ('1', 'A'): 9 }) is policy.rules[0]
+    assert (late.instructor_points, late.comments) == (0, 'No review submitted')
+
+    good = review(peer_score=9)
+    assert policy.apply(good, { ('1', 'A'): 8 }) is policy.rules[2]
+    assert (good.instructor_points, good.comments) == (9, '9 of a team median 8')
+
+def test_apply_escalates_without_scoring():
+    low = review(peer_score=7)
+    rule = policy.apply(low, { ('1', 'A'): 9.5 })
+    assert rule is policy.rules[1] and rule.escalate
+    assert (low.instructor_points, low.comments) == (None, '')
+
+def test_apply_no_match():
+    unmatched = review(peer_score=5)
+    assert policy.apply(unmatched, {}) is None
+    assert (unmatched.instructor_points, unmatched.comments) == (None, '')
+
+def test_team_medians():
+    reviews = [ review(peer_score=score, group=group) for score, group in ((1, 'A'), (5, 'A'), (9, 'A'), (4, 'B')) ]
+    assert policy.team_medians(reviews) == { ('1', 'A'): 5, ('1', 'B'): 4 }
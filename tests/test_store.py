@@ -0,0 +1,55 @@
+import json
+
+import pytest
+
+from app import synthetic
+from app.store import Store
+
+@pytest.fixture
+def store(tmp_path):
+    store = Store(str(tmp_path / 'reviews.db'))
+    yield store
+    store.close()
+
+@pytest.mark.parametrize('encoding, delimiter', [ ('utf-8', ','), ('utf-16', '\t') ])
+def test_export_round_trip(tmp_path, store, encoding, delimiter):
+    cohort = synthetic.make_cohort(60)
+    export = tmp_path / 'export.txt'
+    synthetic.write_export(str(export), cohort, encoding=encoding, delimiter=delimiter)
+    submissions = store.import_export(str(export), synthetic.review_item)
+    assert store.import_export(str(export), synthetic.review_item) == submissions
+
+    written = tmp_path / 'written.txt'
+    store.export_export(synthetic.review_item, str(written))
+    assert written.read_bytes() == export.read_bytes()
+
+def test_same_named_exports_kept_apart(tmp_path, store):
+    for directory, seed in (('a', 1), ('b', 2)):
+        (tmp_path / directory).mkdir()
+        synthetic.write_export(str(tmp_path / directory / 'export.txt'), synthetic.make_cohort(30, seed=seed), seed=seed)
+        store.import_export(str(tmp_path / directory / 'export.txt'), synthetic.review_item)
+    for directory in ('a', 'b'):
+        written = tmp_path / directory / 'written.txt'
+        store.export_export(synthetic.review_item, str(written), source=str(tmp_path / directory / 'export.txt'))
+        assert written.read_bytes() == (tmp_path / directory / 'export.txt').read_bytes()
+
+def test_gradebook_round_trip(tmp_path, store):
+    gradebook = tmp_path / 'gradebook.csv'
+    synthetic.write_gradebook(str(gradebook), synthetic.make_cohort(60), items=5)
+    store.import_gradebook(str(gradebook))
+    written = tmp_path / 'written.csv'
+    store.export_gradebook(str(written))
+    assert written.read_bytes() == gradebook.read_bytes()
+
+    store.update_scores({ synthetic.review_item: { 'pid000001': ('7', 'Good') } })
+    record = store.gradebook().record_for('student_id', 'pid000001')
+    assert (record.points_cell(synthetic.review_item), record.comments_cell(synthetic.review_item)) == (7.0, 'Good')
+
+def test_aliases_round_trip(tmp_path, store):
+    journal = tmp_path / 'aliases.txt'
+    journal.write_text(''.join(json.dumps(pair) + '\n' for pair in [ ['bob', 'Robert Smith'], ['zoë', 'Zoë Lee'] ]),
+                       encoding='utf-8')
+    store.import_aliases(str(journal))
+    written = tmp_path / 'written.txt'
+    store.export_aliases(str(written))
+    assert written.read_text(encoding='utf-8') == '["bob", "Robert Smith"]\n["zoë", "Zoë Lee"]\n'
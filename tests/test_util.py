@@ -0,0 +1,61 @@
+import json
+import random
+
+import pytest
+
+from util import levenshtein, damerau_levenshtein, levenshtein_bitparallel, bitparallel_masks, nearest, replay_journal
+
+def random_words(rng, n, alphabet='abcde', longest=12):
+    return [ ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, longest))) for _ in range(n) ]
+
+def test_bitparallel_matches_levenshtein():
+    rng = random.Random(0)
+    words = random_words(rng, 200)
+    for s1, s2 in zip(words, reversed(words)):
+        assert levenshtein_bitparallel(s1, s2) == levenshtein(s1, s2)
+        assert levenshtein_bitparallel(s1, s2, bitparallel_masks(s1)) == levenshtein(s1, s2)
+
+def test_bitparallel_cutoff():
+    rng = random.Random(1)
+    words = random_words(rng, 200)
+    for s1, s2 in zip(words, reversed(words)):
+        distance = levenshtein(s1, s2)
+        for max_distance in range(4):
+            expected = distance if distance <= max_distance else max_distance + 1
+            assert levenshtein_bitparallel(s1, s2, max_distance=max_distance) == expected
+
+def test_nearest_matches_sorted_levenshtein():
+    rng = random.Random(2)
+    choices = random_words(rng, 100)
+    for query in random_words(rng, 20):
+        expected = sorted(range(len(choices)), key=lambda i: (levenshtein(query, choices[i]), i))[:5]
+        assert nearest(query, choices) == [ choices[i] for i in expected ]
+
+def test_damerau_levenshtein_matches_edits():
+    from app.corrector import edits1
+    rng = random.Random(3)
+    for _ in range(60):
+        s1, s2 = random_words(rng, 2, 'abc', 5)
+        reachable1 = edits1(s1)
+        reachable2 = { e2 for e1 in reachable1 for e2 in edits1(e1) }
+        expected = 0 if s1 == s2 else 1 if s2 in reachable1 else 2 if s2 in reachable2 else 3
+        assert min(damerau_levenshtein(s1, s2), 3) == expected
+        assert damerau_levenshtein(s1, s2) == damerau_levenshtein(s2, s1)
+
+def test_replay_journal_cuts_torn_record(tmp_path):
+    journal = tmp_path / 'journal'
+    journal.write_bytes(b'[1]\n\n[2]\n[3')
+    records = []
+    replay_journal(str(journal), lambda line: records.append(json.loads(line)))
+    assert records == [ [1], [2] ]
+    assert journal.read_bytes() == b'[1]\n\n[2]\n'
+
+    journal.write_bytes(b'[1]\n[2]')
+    replay_journal(str(journal), lambda line: json.loads(line))
+    assert journal.read_bytes() == b'[1]\n[2]\n'
+
+    journal.write_bytes(b'[1\n[2]\n')
+    with pytest.raises(ValueError, match='line 1'):
+        replay_journal(str(journal), lambda line: json.loads(line))
+    replay_journal(str(journal), lambda line: records.append(json.loads(line)), strict=False)
+    assert records[-1] == [2]
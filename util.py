@@ -1,3 +1,50 @@
+import heapq
+import os
+from collections import Counter
+
+# hot path operation counts, reported by manager_review.py --profile;
+# only kept while a Profiler turns counting on
+counters = Counter()
+counting = False
+
+def count(name, n=1):
+    if counting:
+        counters[name] += n
+
+def replay_journal(fname, replay, repair=True, strict=True):
+    """Call replay with each non-blank line of the append-only journal
+fname. replay raises ValueError for a record it can't read. A last line
+without its newline that can't be read is a record torn by a crash: it is
+dropped and, with repair, cut from the file. With repair the file is also
+left ending in a newline, so the next record starts on its own line. An
+unreadable record before the last line is an error, or skipped if not
+strict."""
+    with open(fname, 'rb') as f:
+        data = f.read()
+    lines = data.split(b'\n')
+    tail = lines.pop()
+    for number, line in enumerate(lines, 1):
+        try:
+            if line.strip():
+                replay(line.decode('utf-8'))
+        except ValueError as e:
+            if strict:
+                raise ValueError('{}: line {}: {}'.format(fname, number, e))
+    if not tail.strip():
+        return
+    try:
+        replay(tail.decode('utf-8'))
+    except ValueError:
+        if repair:
+            with open(fname, 'r+b') as f:
+                f.truncate(len(data) - len(tail))
+                os.fsync(f.fileno())
+    else:
+        if repair:
+            with open(fname, 'ab') as f:
+                f.write(b'\n')
+                os.fsync(f.fileno())
+
 def num_or_string(value):
     try:
         return float(value)
@@ -27,6 +74,7 @@ def label_to_attr(string):
 def levenshtein(s1, s2):
     if len(s1) < len(s2):
         return levenshtein(s2, s1)
+    count('levenshtein')
 
     # len(s1) >= len(s2)
     if len(s2) == 0:
@@ -43,3 +91,90 @@ def levenshtein(s1, s2):
         previous_row = current_row
 
     return previous_row[-1]
+
+def damerau_levenshtein(s1, s2):
+    """Levenshtein distance where transposing two adjacent characters also
+counts as a single edit, even when other edits fall between or next to
+the transposed pair (Lowrance-Wagner, unlike optimal string alignment)"""
+    count('levenshtein')
+    infinity = len(s1) + len(s2)
+    # d[i + 1][j + 1] is the distance between s1[:i] and s2[:j]
+    d = [ [ infinity ] * (len(s2) + 2) ] + [ [ infinity, i ] + [ 0 ] * len(s2) for i in range(len(s1) + 1) ]
+    d[1][1:] = range(len(s2) + 1)
+    last_row = {} # last row of each character of s1
+    for i, c1 in enumerate(s1, 1):
+        last_column = 0
+        for j, c2 in enumerate(s2, 1):
+            k, l = last_row.get(c2, 0), last_column
+            if c1 == c2:
+                cost, last_column = 0, j
+            else:
+                cost = 1
+            d[i + 1][j + 1] = min(d[i][j] + cost, d[i + 1][j] + 1, d[i][j + 1] + 1,
+                                  d[k][l] + (i - k - 1) + 1 + (j - l - 1))
+        last_row[c1] = i
+    return d[-1][-1]
+
+def bitparallel_masks(s):
+    """Per-character match bitmasks of s, for levenshtein_bitparallel"""
+    masks = {}
+    for i, c in enumerate(s):
+        masks[c] = masks.get(c, 0) | (1 << i)
+    return masks
+
+def levenshtein_bitparallel(s1, s2, masks=None, max_distance=None):
+    """Levenshtein distance using Myers/Hyyro bit-parallel algorithm.
+
+masks, from bitparallel_masks(s1), may be passed in when s1 is compared
+against many strings. When max_distance is given the scan stops as soon
+as the distance must exceed it and max_distance + 1 is returned."""
+    count('levenshtein')
+    m = len(s1)
+    if max_distance is not None and abs(m - len(s2)) > max_distance:
+        return max_distance + 1
+    if m == 0:
+        return len(s2)
+    if masks is None:
+        masks = bitparallel_masks(s1)
+
+    full = (1 << m) - 1
+    last = 1 << (m - 1)
+    pv = full # vertical +1 deltas
+    mv = 0    # vertical -1 deltas
+    score = m
+    remaining = len(s2)
+    for c in s2:
+        eq = masks.get(c, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & full)
+        mh = pv & xh
+        if ph & last:
+            score += 1
+        elif mh & last:
+            score -= 1
+        ph = ((ph << 1) | 1) & full
+        mh = (mh << 1) & full
+        pv = mh | (~(xv | ph) & full)
+        mv = ph & xv
+        remaining -= 1
+        if max_distance is not None and score - remaining > max_distance:
+            return max_distance + 1
+
+    return score
+
+def nearest(query, choices, k=5, key=None):
+    """The k choices with the smallest levenshtein distance to query,
+closest first. Ties keep their order in choices."""
+    masks = bitparallel_masks(query)
+    heap = [] # max-heap of the best k as (-distance, -position, choice)
+    for position, choice in enumerate(choices):
+        cutoff = -heap[0][0] if len(heap) == k else None
+        distance = levenshtein_bitparallel(query, key(choice) if key else choice, masks, cutoff)
+        if cutoff is not None and distance >= cutoff:
+            continue
+        if len(heap) == k:
+            heapq.heapreplace(heap, (-distance, -position, choice))
+        elif k > 0:
+            heapq.heappush(heap, (-distance, -position, choice))
+    return [ choice for _, _, choice in sorted(heap, reverse=True) ]